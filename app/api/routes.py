@@ -1,18 +1,27 @@
 from typing import List
 
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import ORJSONResponse
 
 from ..core.security import create_access_token, jwt_guard
-from ..db.mongo import get_db
 from ..models.schemas import SequenceIn, SequenceOut, SubsequenceListItem
-from ..repositories.subsequence_repo import SubsequenceRepository
 from ..services.subsequence_service import SubsequenceService
 
 router = APIRouter()
 
 
+async def get_service(request: Request) -> SubsequenceService:
+    # Construido una sola vez en el startup de la app (ver app.main)
+    return request.app.state.service
+
+
+async def get_app_db(request: Request):
+    # La misma base que recibió el servicio en el startup
+    return request.app.state.db
+
+
 @router.get("/health", tags=["health"])
-async def health_check(db=Depends(get_db)):
+async def health_check(db=Depends(get_app_db)):
     """
     Health check endpoint para verificar el estado de la aplicación y MongoDB.
     """
@@ -47,13 +56,16 @@ def issue_token():
     dependencies=[Depends(jwt_guard)],
     tags=["sequences"],
 )
-async def create_sequences(payload: SequenceIn, db=Depends(get_db)):
-    service = SubsequenceService(SubsequenceRepository(db))
+async def create_sequences(
+    payload: SequenceIn, service: SubsequenceService = Depends(get_service)
+):
     try:
         result = await service.create_from_sequence(payload.items)
-        return result
     except ValueError as e:
         raise HTTPException(status_code=422, detail=str(e)) from e
+    # El servicio ya devuelve la forma de SequenceOut: responder directo evita
+    # re-validar con pydantic (response_model queda solo para OpenAPI)
+    return ORJSONResponse(result)
 
 
 @router.get(
@@ -64,7 +76,7 @@ async def create_sequences(payload: SequenceIn, db=Depends(get_db)):
 )
 async def list_subsequences(
     limit: int = Query(10, ge=1, le=50), 
-    db=Depends(get_db)
+    service: SubsequenceService = Depends(get_service)
 ):
-    service = SubsequenceService(SubsequenceRepository(db))
-    return await service.list_latest(limit=limit)
\ No newline at end of file
+    # Sin re-validación de pydantic: recorrería cada entero de cada subsecuencia
+    return ORJSONResponse(await service.list_latest(limit=limit))
\ No newline at end of file
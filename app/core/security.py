@@ -1,8 +1,17 @@
+import base64
+import binascii
+import hmac
+import json
 import os
+import threading
+import time
 import uuid
-from datetime import datetime, timedelta, timezone
+from collections import OrderedDict
+from functools import lru_cache
+from hashlib import sha256
 
 import jwt
+import orjson
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 
@@ -15,36 +24,152 @@ if not JWT_SECRET:
 JWT_ALG = os.getenv("JWT_ALGORITHM", "HS256")
 JWT_EXPIRE_MIN = int(os.getenv("JWT_EXPIRE_MIN", "10"))
 
+# Cache de tokens ya verificados: sha256(token)[:16] -> instante hasta el que se aceptan.
+# Solo se guarda el vencimiento (nunca el token) y como mucho por _TOKEN_CACHE_TTL segundos.
+# LRU: al llenarse se descarta el token usado hace más tiempo, no todo el cache.
+_TOKEN_CACHE_TTL = min(30, JWT_EXPIRE_MIN * 60)
+_TOKEN_CACHE_MAXSIZE = 10_000
+_verified_tokens: OrderedDict[bytes, float] = OrderedDict()
+# jwt_guard es sync: FastAPI lo corre en el threadpool, así que get + move_to_end/del
+# no son atómicos. El lock cubre solo las operaciones del cache, no el decode.
+_verified_tokens_lock = threading.Lock()
 
+# Clave HMAC precalculada para el camino rápido de HS256: se copia el estado
+# ya inicializado en vez de derivar la clave en cada token
+_key = JWT_SECRET.encode()
+_signer = hmac.new(_key, digestmod=sha256)
+_URLSAFE = bytes.maketrans(b"+/", b"-_")
+
+
+def _b64url_encode(data: bytes) -> bytes:
+    # binascii directo: evita la capa Python de base64.urlsafe_b64encode
+    return binascii.b2a_base64(data, newline=False).translate(_URLSAFE).rstrip(b"=")
+
+
+def _sign(signing_input: bytes) -> bytes:
+    mac = _signer.copy()
+    mac.update(signing_input)
+    return mac.digest()
+
+
+_HEADER_B64 = _b64url_encode(b'{"alg":"HS256","typ":"JWT"}')
+
+
+@lru_cache(maxsize=2)
+def _claims_prefix(now_sec: int) -> bytes:
+    # iat/exp solo cambian una vez por segundo: el JSON hasta el jti se reutiliza
+    claims = {"sub": "api-client", "iat": now_sec, "exp": now_sec + JWT_EXPIRE_MIN * 60}
+    return orjson.dumps(claims)[:-1] + b',"jti":"'
 
 
 def create_access_token() -> str:
-    now = datetime.now(timezone.utc)
-    exp = now + timedelta(minutes=JWT_EXPIRE_MIN)
+    now_sec = int(time.time())
     # Include a unique token identifier to ensure different tokens per request
-    payload = {
-        "sub": "api-client",
-        "iat": int(now.timestamp()),
-        "exp": int(exp.timestamp()),
-        "jti": uuid.uuid4().hex,
-    }
-    return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALG)
+    payload_json = _claims_prefix(now_sec) + uuid.uuid4().hex.encode() + b'"}'
+    if JWT_ALG != "HS256":  # pragma: no cover
+        return jwt.encode(orjson.loads(payload_json), JWT_SECRET, algorithm=JWT_ALG)
+    signing_input = _HEADER_B64 + b"." + _b64url_encode(payload_json)
+    return (signing_input + b"." + _b64url_encode(_sign(signing_input))).decode()
+
+
+
+
+# Claims que emite create_access_token: un token sin ellos no es nuestro
+_REQUIRED_CLAIMS = ("exp", "iat", "sub")
+# Otros algoritmos: instancia y opciones de PyJWT armadas una sola vez
+_pyjwt = jwt.PyJWT()
+_PYJWT_OPTIONS = {"require": list(_REQUIRED_CLAIMS), "verify_aud": False}
+
+
+def _b64url_decode(segment: str) -> bytes:
+    try:
+        return base64.urlsafe_b64decode(segment + "=" * (-len(segment) % 4))
+    except (binascii.Error, ValueError):
+        raise jwt.DecodeError("Invalid base64 segment") from None
+
+
+def _int_claim(payload: dict, claim: str, error: type[jwt.InvalidTokenError]) -> int:
+    try:
+        return int(payload[claim])
+    except (TypeError, ValueError):
+        raise error(f"{claim} must be an integer") from None
+
+
+def _decode_fast(token: str) -> dict:
+    # HS256 a mano: un HMAC-SHA256 y dos json.loads, sin la maquinaria de PyJWT
+    try:
+        header_b64, payload_b64, signature_b64 = token.split(".")
+    except ValueError:
+        raise jwt.DecodeError("Not enough segments") from None
+    signing_input = f"{header_b64}.{payload_b64}".encode()
+    expected = _sign(signing_input)
+    if not hmac.compare_digest(_b64url_decode(signature_b64), expected):
+        raise jwt.InvalidSignatureError("Signature verification failed")
+    try:
+        header = json.loads(_b64url_decode(header_b64))
+        payload = json.loads(_b64url_decode(payload_b64))
+    except ValueError:
+        raise jwt.DecodeError("Invalid token segment") from None
+    # Mismas reglas que PyJWT 2.9: algoritmo fijo, claims requeridos no nulos y
+    # claims temporales convertidos con int() (trunca floats, acepta "123")
+    if not isinstance(header, dict) or header.get("alg") != "HS256":
+        raise jwt.InvalidAlgorithmError("The specified alg value is not allowed")
+    if not isinstance(payload, dict):
+        raise jwt.DecodeError("Invalid payload")
+    for claim in _REQUIRED_CLAIMS:
+        if payload.get(claim) is None:
+            raise jwt.MissingRequiredClaimError(claim)
+    now = time.time()
+    if _int_claim(payload, "iat", jwt.InvalidIssuedAtError) > now:
+        raise jwt.ImmatureSignatureError("The token is not yet valid (iat)")
+    if "nbf" in payload and _int_claim(payload, "nbf", jwt.DecodeError) > now:
+        raise jwt.ImmatureSignatureError("The token is not yet valid (nbf)")
+    if _int_claim(payload, "exp", jwt.DecodeError) <= now:
+        raise jwt.ExpiredSignatureError("Signature has expired")
+    return payload
+
+
+def _decode(token: str) -> dict:
+    if JWT_ALG == "HS256":
+        return _decode_fast(token)
+    return _pyjwt.decode(  # pragma: no cover
+        token, JWT_SECRET, algorithms=[JWT_ALG], options=_PYJWT_OPTIONS
+    )
+
+
+class TokenExpiredError(HTTPException):
+    # Instancia nueva por request (una instancia compartida acumularía
+    # __traceback__ entre requests), pero sin armar status/detail cada vez
+    def __init__(self):
+        super().__init__(status.HTTP_401_UNAUTHORIZED, "Token expirado")
 
 
+class TokenInvalidError(HTTPException):
+    def __init__(self):
+        super().__init__(status.HTTP_401_UNAUTHORIZED, "Token inválido")
 
 
 def jwt_guard(credentials: HTTPAuthorizationCredentials = Depends(bearer)):
     token = credentials.credentials
+    key = sha256(token.encode()).digest()[:16]
+    now = time.time()
+    # Token ya verificado hace poco: no repetir HMAC + decode
+    with _verified_tokens_lock:
+        valid_until = _verified_tokens.get(key)
+        if valid_until is not None:
+            if valid_until > now:
+                _verified_tokens.move_to_end(key)
+                return True
+            del _verified_tokens[key]
     try:
-        jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALG])
+        payload = _decode(token)
     except jwt.ExpiredSignatureError:  # pragma: no cover
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED, 
-            detail="Token expirado"
-        ) from None
+        raise TokenExpiredError() from None
     except jwt.InvalidTokenError:  # pragma: no cover
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED, 
-            detail="Token inválido"
-        ) from None
-    return True
\ No newline at end of file
+        raise TokenInvalidError() from None
+    # Solo los tokens válidos entran al cache
+    with _verified_tokens_lock:
+        if len(_verified_tokens) >= _TOKEN_CACHE_MAXSIZE:
+            _verified_tokens.popitem(last=False)
+        _verified_tokens[key] = min(int(payload["exp"]), now + _TOKEN_CACHE_TTL)
+    return True
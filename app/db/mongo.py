@@ -1,3 +1,4 @@
+import asyncio
 import os
 
 from motor.motor_asyncio import AsyncIOMotorClient
@@ -6,6 +7,13 @@ MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
 DB_NAME = os.getenv("MONGODB_DB", "seqdb")
 COL_SEQ = os.getenv("MONGODB_SEQ_COL", "sequences")
 COL_SUB = os.getenv("MONGODB_SUBSEQ_COL", "subsequences")
+# Pool de conexiones: minPoolSize mantiene sockets abiertos para las ráfagas
+MAX_POOL_SIZE = int(os.getenv("MONGODB_MAX_POOL", "200"))
+MIN_POOL_SIZE = int(os.getenv("MONGODB_MIN_POOL", "10"))
+TIMEOUT_MS = int(os.getenv("MONGODB_TIMEOUT_MS", "5000"))
+# Compresión opt-in: zlib gasta CPU en payloads chicos. "zlib" viene con Python;
+# zstd/snappy requieren instalar zstandard/python-snappy
+COMPRESSORS = os.getenv("MONGODB_COMPRESSORS", "")
 
 
 _client: AsyncIOMotorClient | None = None
@@ -14,7 +22,15 @@ _client: AsyncIOMotorClient | None = None
 def get_client() -> AsyncIOMotorClient:
     global _client
     if _client is None: #pragma: no cover
-        _client = AsyncIOMotorClient(MONGODB_URI)
+        _client = AsyncIOMotorClient(
+            MONGODB_URI,
+            maxPoolSize=MAX_POOL_SIZE,
+            minPoolSize=MIN_POOL_SIZE,
+            serverSelectionTimeoutMS=TIMEOUT_MS,
+            waitQueueTimeoutMS=TIMEOUT_MS,
+            retryWrites=True,
+            compressors=COMPRESSORS or None,
+        )
     return _client
 
 
@@ -27,4 +43,10 @@ async def ensure_indexes(db): #pragma: no cover
     # Unicidad global por hash de items (subsecuencia canonical)
     await db[COL_SUB].create_index("items_hash", unique=True)
     await db[COL_SUB].create_index([("created_at", -1)])
-    await db[COL_SUB].create_index("sequence_id")
\ No newline at end of file
+    # Subsecuencias de una secuencia ya en orden de listado
+    await db[COL_SUB].create_index([("sequence_id", 1), ("rank", 1)])
+
+
+async def warmup_pool(db, connections: int = MIN_POOL_SIZE):
+    # Pings concurrentes para abrir las conexiones antes del primer request
+    await asyncio.gather(*(db.command("ping") for _ in range(max(connections, 1))))
@@ -1,12 +1,16 @@
 import logging
 import time
 
-from fastapi import FastAPI, Request
+from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 
 from .api.routes import router
-from .db.mongo import ensure_indexes, get_db
+from .db.mongo import ensure_indexes, get_db, warmup_pool
+from .repositories.subsequence_repo import SubsequenceRepository
+from .services.subsequence_service import SubsequenceService
 
-app = FastAPI(title="Sequence API")
+# orjson serializa las listas de enteros anidadas de /subsequences mucho más rápido
+app = FastAPI(title="Sequence API", default_response_class=ORJSONResponse)
 app.include_router(router)
 
 
@@ -15,6 +19,10 @@ async def on_startup():
 
     db = await get_db()
     await ensure_indexes(db)
+    await warmup_pool(db)
+    app.state.db = db
+    # El servicio es stateless: se construye una vez y se comparte entre requests
+    app.state.service = SubsequenceService(SubsequenceRepository(db))
 
 
 # Configure basic structured logging
@@ -25,16 +33,40 @@ logging.basicConfig(
 logger = logging.getLogger("app")
 
 
-@app.middleware("http")
-async def request_timing_middleware(request: Request, call_next):
-    start = time.perf_counter()
-    response = await call_next(request)
-    duration_ms = round((time.perf_counter() - start) * 1000, 2)
-    # Minimal structured access log
-    user_agent = request.headers.get('user-agent', '')
-    logger.info(
-        f"request method={request.method} path={request.url.path} "
-        f"status={response.status_code} duration_ms={duration_ms} "
-        f'ua="{user_agent}"'
-    )
-    return response
\ No newline at end of file
+class RequestTimingMiddleware:
+    """
+    Middleware ASGI puro para el access log.
+    Evita BaseHTTPMiddleware: no crea Request/Response ni tareas extra por request.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        # Sin access log habilitado no hay nada que medir
+        if scope["type"] != "http" or not logger.isEnabledFor(logging.INFO):
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status_code = 0
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+        duration_ms = (time.perf_counter() - start) * 1000
+        # Minimal structured access log
+        user_agent = next(
+            (v.decode("latin-1") for k, v in scope["headers"] if k == b"user-agent"), ""
+        )
+        logger.info(
+            'request method=%s path=%s status=%d duration_ms=%.2f ua="%s"',
+            scope["method"], scope["path"], status_code, duration_ms, user_agent,
+        )
+
+
+app.add_middleware(RequestTimingMiddleware)
@@ -26,7 +26,7 @@ class SequenceOut(BaseModel):
 class SubsequenceDoc(BaseModel):
     items: list[int]
     created_at: datetime
-    items_hash: str
+    items_hash: bytes
     sequence_id: str
 
 
@@ -1,153 +1,296 @@
 from __future__ import annotations
 
+import asyncio
 import logging
+import os
 import time
+from collections import defaultdict
 from datetime import datetime, timezone
-from hashlib import sha256
+from functools import lru_cache
+from hashlib import blake2b
+from itertools import islice
+from typing import Iterable, Iterator
 
 from bson import ObjectId
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from pymongo import UpdateOne
-from pymongo.errors import DuplicateKeyError
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 
 from ..db.mongo import COL_SEQ, COL_SUB
 
+logger = logging.getLogger(__name__)
 
-def _hash_items(items: list[int]) -> str:
-    # Crear hash único ordenando los elementos
-    key = ",".join(str(x) for x in sorted(items))
-    return sha256(key.encode()).hexdigest()
+# Operaciones por llamada a bulk_write y cuántas llamadas pueden estar en vuelo
+BULK_CHUNK_SIZE = 2000
+BULK_MAX_CONCURRENCY = 4
+# Segundos que se reutiliza el resultado de latest_grouped (por proceso; las
+# escrituras de este repositorio lo invalidan al terminar)
+LATEST_CACHE_TTL = 2.0
 
+# Secreto del servidor para las claves por elemento. Sin él, cualquiera podría
+# calcular los digests y armar conjuntos distintos con el mismo XOR (ataque de
+# cumpleaños generalizado) para ocupar de antemano el items_hash de otro.
+# Debe ser el mismo en todos los procesos: cambiarlo invalida los hashes guardados.
+ITEMS_HASH_KEY = os.getenv("ITEMS_HASH_KEY")
+if not ITEMS_HASH_KEY:
+    raise RuntimeError("ITEMS_HASH_KEY must be set in environment")
+_items_hash_key = ITEMS_HASH_KEY.encode()
+if len(_items_hash_key) > blake2b.MAX_KEY_SIZE:
+    raise RuntimeError(f"ITEMS_HASH_KEY must be at most {blake2b.MAX_KEY_SIZE} bytes")
 
 
+@lru_cache(maxsize=65536)
+def _element_key(x: int) -> int:
+    # Clave pseudoaleatoria de 128 bits por producto: BLAKE2b con clave del id (int64)
+    digest = blake2b(
+        x.to_bytes(8, "little", signed=True), key=_items_hash_key, digest_size=16
+    ).digest()
+    return int.from_bytes(digest, "little")
+
+
+def _hash_items(items: list[int]) -> bytes:
+    # XOR de las claves de cada elemento: identifica el conjunto sin importar el
+    # orden y permite obtener la clave de cada subsecuencia con un solo XOR
+    # a partir de tablas precalculadas (ver generate_subsequence_keys).
+    # Solo está definido para conjuntos: un elemento repetido se cancela
+    # ([1, 1] da lo mismo que []), por eso la entrada pasa por _require_canonical.
+    # Se guarda como 16 bytes (BSON binary): la mitad que el hex en el índice único
+    key = 0
+    for x in items:
+        key ^= _element_key(x)
+    return key.to_bytes(16, "big")
+
+
+def _require_canonical(items: list[int]) -> None:
+    # Forma canónica: estrictamente creciente (ordenada y sin repetidos)
+    if any(a >= b for a, b in zip(items, items[1:])):
+        raise ValueError(f"items must be strictly increasing, got {items!r}")
+
+
+def _as_object_id(sequence_id: str):
+    # sequence_id se guarda como ObjectId para poder cruzarlo directo con sequences._id
+    try:
+        return ObjectId(sequence_id)
+    except Exception:
+        return sequence_id  # fallback a string u otro tipo
+
+
+def _take(it: Iterator, size: int) -> list:
+    return list(islice(it, size))
+
+
+# Código de MongoDB para clave duplicada (índice único de items_hash)
+DUPLICATE_KEY = 11000
+
+
+def _bulk_counts_ignoring_duplicates(exc: BulkWriteError) -> tuple[int, int]:
+    # Dos upserts concurrentes del mismo items_hash: uno gana y el otro choca
+    # con el índice único. Es la misma deduplicación silenciosa de upsert_subsequence.
+    details = exc.details
+    if details.get("writeConcernErrors") or any(
+        err.get("code") != DUPLICATE_KEY for err in details.get("writeErrors", [])
+    ):
+        raise exc
+    return details.get("nUpserted", 0), details.get("nModified", 0)
+
 
 class SubsequenceRepository:
     def __init__(self, db: AsyncIOMotorDatabase):
         self.db = db
-        self.logger = logging.getLogger("app.repositories.subsequence_repo")
+        # limit -> (instante monotónico, resultado); la versión evita guardar
+        # una lectura que empezó antes de una escritura
+        self._latest_cache: dict[int, tuple[float, list]] = {}
+        self._latest_version = 0
 
+    def _invalidate_latest(self):
+        self._latest_version += 1
+        self._latest_cache.clear()
 
-    async def insert_sequence(self, items: list[int]) -> str:
-        start = time.perf_counter()
+
+    async def insert_sequence(self, items: list[int], now: datetime | None = None) -> str:
+        timed = logger.isEnabledFor(logging.INFO)
+        start = time.perf_counter() if timed else 0.0
         doc = {
         "items": items,
-        "created_at": datetime.now(timezone.utc),
+        "created_at": now or datetime.now(timezone.utc),
         }
         res = await self.db[COL_SEQ].insert_one(doc)
-        duration_ms = round((time.perf_counter() - start) * 1000, 2)
-        self.logger.info(f"insert_sequence size={len(items)} duration_ms={duration_ms}")
+        self._invalidate_latest()
+        if timed:
+            logger.info(
+                "insert_sequence size=%d duration_ms=%.2f",
+                len(items), (time.perf_counter() - start) * 1000,
+            )
         return str(res.inserted_id)
 
 
-    async def upsert_subsequence(self, sequence_id: str, items: list[int]):
+    async def upsert_subsequence(
+        self,
+        sequence_id: str,
+        items: list[int],
+        now: datetime | None = None,
+        *,
+        rank: int,
+    ):
+        # rank es obligatorio: latest_grouped ordena por él, y un valor por defecto
+        # pondría esta subsecuencia antes que todas las de longitud 1
+        _require_canonical(items)
         h = _hash_items(items)
-        # Manejar tanto ObjectId como string para sequence_id
-        try:
-            seq_id_value = ObjectId(sequence_id)
-        except Exception:
-            seq_id_value = sequence_id  # fallback a string u otro tipo
+        seq_id_value = _as_object_id(sequence_id)
 
         doc = {
-            "items": sorted(items),
+            "items": items,
             "items_hash": h,
             "sequence_id": seq_id_value,
-            "created_at": datetime.now(timezone.utc),
+            "created_at": now or datetime.now(timezone.utc),
+            "rank": rank,
         }
-        # Si ya existe, no hacer nada
+        # Si ya existe, no hacer nada: upsert con $setOnInsert, sin excepción
+        # en el caso común de un duplicado
         try:
-            await self.db[COL_SUB].insert_one(doc)
+            await self.db[COL_SUB].update_one(
+                {"items_hash": h}, {"$setOnInsert": doc}, upsert=True
+            )
         except DuplicateKeyError:
-            # Ya existe, no pasa nada
-            self.logger.debug("upsert_subsequence duplicate ignored items_hash=%s", h)
+            # Solo en carrera con otro upsert del mismo hash: ya existe
+            logger.debug("upsert_subsequence duplicate ignored items_hash=%s", h.hex())
         except Exception:
             # Re-lanzar otros errores
             raise
+        self._invalidate_latest()
 
     async def insert_subsequences_bulk(
-        self, sequence_id: str, subsequences: list[list[int]]
+        self,
+        sequence_id: str,
+        subsequences: Iterable[list[int]],
+        items_hashes: Iterable[bytes] | None = None,
+        now: datetime | None = None,
     ) -> int:
         """
         Inserta muchas subsecuencias de una vez.
-        Es más rápido que insertar una por una cuando hay muchas.
+        Acepta cualquier iterable (p.ej. un generador): las operaciones se
+        construyen y envían por lotes, sin materializar todas en memoria.
+        Si se pasan items_hashes (en el mismo orden) no se recalcula el hash;
+        si no, cada subsecuencia debe ser estrictamente creciente (ValueError).
+        Cada documento guarda su posición (rank) para listar en el mismo orden.
+        now permite compartir el mismo created_at con la secuencia padre.
         """
-        if not subsequences:
-            return 0
-            
-        # Usar string para que funcione con los tests
-        seq_id_value = sequence_id
-
-        now = datetime.now(timezone.utc)
-        operations = []
-        
-        for items in subsequences:
-            h = _hash_items(items)
-            doc = {
-                "items": sorted(items),
-                "items_hash": h,
-                "sequence_id": seq_id_value,
-                "created_at": now,
-            }
-            
-            # Upsert para no duplicar si ya existe
-            operation = UpdateOne(
-                {"items_hash": h},  # buscar por hash
-                {"$setOnInsert": doc},  # insertar solo si no existe
-                upsert=True
+        seq_id_value = _as_object_id(sequence_id)
+
+        if now is None:
+            now = datetime.now(timezone.utc)
+        op_count = 0
+
+        if items_hashes is None:
+            def hashed():
+                for items in subsequences:
+                    _require_canonical(items)
+                    yield items, _hash_items(items)
+
+            keyed = hashed()
+        else:
+            keyed = zip(subsequences, items_hashes)
+
+        def operations():
+            nonlocal op_count
+            for rank, (items, h) in enumerate(keyed):
+                doc = {
+                    "items": items,
+                    "items_hash": h,
+                    "sequence_id": seq_id_value,
+                    "created_at": now,
+                    "rank": rank,
+                }
+                op_count += 1
+                # Upsert para no duplicar si ya existe
+                yield UpdateOne(
+                    {"items_hash": h},  # buscar por hash
+                    {"$setOnInsert": doc},  # insertar solo si no existe
+                    upsert=True
+                )
+
+        # Enviar por lotes concurrentes; el semáforo limita los lotes en vuelo
+        # y también cuántos se construyen por adelantado
+        sem = asyncio.Semaphore(BULK_MAX_CONCURRENCY)
+
+        async def flush(chunk):
+            try:
+                res = await self.db[COL_SUB].bulk_write(chunk, ordered=False)
+                return res.upserted_count, res.modified_count
+            except BulkWriteError as exc:
+                return _bulk_counts_ignoring_duplicates(exc)
+            finally:
+                sem.release()
+
+        ops = operations()
+        timed = logger.isEnabledFor(logging.INFO)
+        start = time.perf_counter() if timed else 0.0
+        tasks = []
+        try:
+            while True:
+                await sem.acquire()
+                # Generar subsecuencias y armar el lote (CPU) en un hilo, así el
+                # event loop sigue atendiendo requests y los lotes ya enviados
+                chunk = await asyncio.to_thread(_take, ops, BULK_CHUNK_SIZE)
+                if not chunk:
+                    sem.release()
+                    break
+                tasks.append(asyncio.create_task(flush(chunk)))
+                if len(chunk) < BULK_CHUNK_SIZE:
+                    break
+            results = await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+        finally:
+            self._invalidate_latest()
+        upserted = sum(u for u, _ in results)
+        if timed:
+            logger.info(
+                "insert_subsequences_bulk ops=%d chunks=%d ordered=False "
+                "duration_ms=%.2f upserted=%d",
+                op_count, len(results), (time.perf_counter() - start) * 1000, upserted,
             )
-            operations.append(operation)
-        
-        # Ejecutar todas las operaciones de una vez (más rápido)
-        start = time.perf_counter()
-        result = await self.db[COL_SUB].bulk_write(operations, ordered=False)
-        duration_ms = round((time.perf_counter() - start) * 1000, 2)
-        self.logger.info(
-            f"insert_subsequences_bulk ops={len(operations)} ordered=False "
-            f"duration_ms={duration_ms} upserted={getattr(result,'upserted_count',0)}"
-        )
-        return result.upserted_count + result.modified_count
+        return upserted + sum(m for _, m in results)
 
 
     async def latest_grouped(self, limit: int = 10):
-        pipeline = [
-            # Convertir string a ObjectId para hacer el join
-            {
-                "$addFields": {
-                    "sequence_oid": {"$toObjectId": "$sequence_id"}
-                }
-            },
-            # Agrupar subsecuencias por secuencia original
-            {
-                "$group": {
-                    "_id": "$sequence_id",
-                    "subsequences": {"$push": "$items"},
-                    "created_at": {"$max": "$created_at"},
-                    "sequence_oid": {"$first": "$sequence_oid"}
-                }
-            },
-            # Más recientes primero
-            {"$sort": {"created_at": -1}},
-            # Solo las primeras N
-            {"$limit": limit},
-            # Traer los datos de la secuencia original
-            {
-                "$lookup": {
-                    "from": COL_SEQ,
-                    "localField": "sequence_oid",
-                    "foreignField": "_id",
-                    "as": "seq"
-                }
-            },
-            # Sacar la secuencia del array
-            {"$unwind": "$seq"},
-            # Solo los campos que necesitamos
-            {
-                "$project": {
-                    "sequence": "$seq.items",
-                    "subsequences": 1,
-                    "_id": 0
-                }
-            }
-        ]
-        
-        cursor = self.db[COL_SUB].aggregate(pipeline)
-        return [doc async for doc in cursor]
\ No newline at end of file
+        now = time.monotonic()
+        cached = self._latest_cache.get(limit)
+        if cached is not None and now - cached[0] < LATEST_CACHE_TTL:
+            return cached[1]
+        version = self._latest_version
+        result = await self._read_latest_grouped(limit)
+        if version == self._latest_version:
+            self._latest_cache[limit] = (now, result)
+        return result
+
+    async def _read_latest_grouped(self, limit: int):
+        # Dos lecturas indexadas en lugar de agrupar toda la colección:
+        # 1) las últimas N secuencias (índice created_at)
+        # Solo se decodifica lo que se devuelve: items (y _id para cruzar)
+        seqs = await (
+            self.db[COL_SEQ]
+            .find({}, {"items": 1})
+            .sort("created_at", -1)
+            .limit(limit)
+            .to_list(limit)
+        )
+        if not seqs:
+            return []
+
+        # 2) sus subsecuencias (índice sequence_id + rank, sequence_id como ObjectId;
+        # los documentos viejos con string se migran con scripts/migrate_sequence_id.py).
+        # rank es el orden de generación (tamaño, lexicográfico), así que cada grupo
+        # sale ya ordenado
+        ids = [s["_id"] for s in seqs]
+        cursor = self.db[COL_SUB].find(
+            {"sequence_id": {"$in": ids}},
+            {"items": 1, "sequence_id": 1, "_id": 0},
+        ).sort("rank", 1)
+        by_seq = defaultdict(list)
+        async for doc in cursor:
+            by_seq[doc["sequence_id"]].append(doc["items"])
+
+        return [{"sequence": s["items"], "subsequences": by_seq[s["_id"]]} for s in seqs]
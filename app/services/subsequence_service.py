@@ -2,88 +2,170 @@ from __future__ import annotations
 
 import logging
 import time
-from itertools import combinations
+from array import array
+from datetime import datetime, timezone
+from functools import lru_cache
 from typing import Iterable
 
-from ..repositories.subsequence_repo import SubsequenceRepository
+from ..repositories.subsequence_repo import SubsequenceRepository, _element_key
+
+logger = logging.getLogger(__name__)
+
+# Máximo de productos únicos por secuencia (2^18 - 1 = 262,143 subsecuencias)
+MAX_UNIQUE_ITEMS = 18
+# Tope del payload crudo (con duplicados): se rechaza antes de deduplicar
+MAX_INPUT_ITEMS = 10_000
 
 
 def canonical_sequence(items: list[int]) -> list[int]:
     """
-    Limpia y ordena una secuencia de productos.
+    Limpia, valida y ordena una secuencia de productos.
     
     Quita duplicados y ordena para evitar problemas con el hash.
     En producción sería mejor guardar las frecuencias, pero para este
     challenge simplificamos.
+
+    Lanza ValueError si la entrada cruda supera MAX_INPUT_ITEMS, si queda
+    vacía o si tiene más de MAX_UNIQUE_ITEMS productos únicos. Los tamaños
+    se validan antes de ordenar.
+    """
+    # Rechazar entradas abusivas sin siquiera deduplicarlas
+    if len(items) > MAX_INPUT_ITEMS:
+        raise ValueError(
+            f"La secuencia es demasiado grande: {len(items):,} elementos "
+            f"(máximo {MAX_INPUT_ITEMS:,} incluyendo repetidos)."
+        )
+    unique = set(items)
+    n = len(unique)
+    if n == 0:
+        raise ValueError("La secuencia debe tener al menos un elemento")
+    # límite para evitar que se vuelva muy lento
+    if n > MAX_UNIQUE_ITEMS:
+        total_subs = 2**MAX_UNIQUE_ITEMS - 1
+        raise ValueError(
+            f"La secuencia es demasiado grande: n={n} (límite {MAX_UNIQUE_ITEMS}). "
+            f"El máximo permitido es {total_subs:,} subsecuencias."
+        )
+    return sorted(unique)
+
+
+@lru_cache(maxsize=32)
+def _mask_order(n: int) -> array:
+    """
+    Máscaras de bits 1..2^n-1 en orden de salida: primero por tamaño y
+    dentro de cada tamaño lexicográfico (el bit n-1-i representa items[i]).
+
+    Para k bits el orden lexicográfico es el numérico decreciente, que es el
+    complemento de las máscaras de n-k bits en orden creciente (Gosper).
     """
-    return sorted(set(items))
+    full = (1 << n) - 1
+    order = array("I")
+    for k in range(1, n + 1):
+        comp = (1 << (n - k)) - 1
+        while comp <= full:
+            order.append(full ^ comp)
+            if comp == 0:
+                break
+            low = comp & -comp
+            ripple = comp + low
+            comp = (((ripple ^ comp) >> 2) // low) | ripple
+    return order
+
+
+@lru_cache(maxsize=256)
+def _subset_table(items: tuple[int, ...]) -> list[list[int]]:
+    # table[mask] = elementos elegidos por mask, con el bit len-1-i para items[i].
+    # Como mucho 2^9 entradas por mitad: se cachea por entrada y nunca se expone,
+    # cada subsecuencia generada es una lista nueva (concatenación).
+    table: list[list[int]] = [[]]
+    for x in reversed(items):
+        table += [[x, *sub] for sub in table]
+    return table
+
 
 def generate_subsequences(items: list[int]) -> Iterable[list[int]]:
-    # Genera todas las combinaciones, primero las más cortas
+    # Genera todas las combinaciones, primero las más cortas.
+    # Cada máscara se parte en dos mitades que se resuelven con tablas
+    # precalculadas, así cada subsecuencia es una sola concatenación.
     n = len(items)
-    for k in range(1, n + 1):
-        for combo in combinations(items, k):
-            yield list(combo)
+    if n == 0:
+        return
+    low_bits = n // 2
+    low_mask = (1 << low_bits) - 1
+    high = _subset_table(tuple(items[: n - low_bits]))
+    low = _subset_table(tuple(items[n - low_bits :]))
+    for mask in _mask_order(n):
+        yield high[mask >> low_bits] + low[mask & low_mask]
+
+
+@lru_cache(maxsize=256)
+def _key_table(items: tuple[int, ...]) -> list[int]:
+    # table[mask] = XOR de las claves de los elementos elegidos por mask
+    table = [0]
+    for x in reversed(items):
+        key = _element_key(x)
+        table += [key ^ other for other in table]
+    return table
+
+
+def generate_subsequence_keys(items: list[int]) -> Iterable[bytes]:
+    # items_hash de cada subsecuencia, en el mismo orden que generate_subsequences.
+    # Con las tablas de cada mitad cada clave cuesta un solo XOR.
+    n = len(items)
+    if n == 0:
+        return
+    low_bits = n // 2
+    low_mask = (1 << low_bits) - 1
+    high = _key_table(tuple(items[: n - low_bits]))
+    low = _key_table(tuple(items[n - low_bits :]))
+    for mask in _mask_order(n):
+        yield (high[mask >> low_bits] ^ low[mask & low_mask]).to_bytes(16, "big")
 
 
 class SubsequenceService:
     def __init__(self, repo: SubsequenceRepository):
         self.repo = repo
-        self.logger = logging.getLogger("app.services.subsequence_service")
 
 
     async def create_from_sequence(self, items: list[int]) -> dict:
         canon = canonical_sequence(items)
         n = len(canon)
-        if n == 0:
-            raise ValueError("La secuencia debe tener al menos un elemento")
-        # límite para evitar que se vuelva muy lento
-        if n > 18:
-            limit_n = 18
-            total_subs = 2**limit_n - 1
-            raise ValueError(
-                f"La secuencia es demasiado grande: n={n} (límite {limit_n}). "
-                f"El máximo permitido es {total_subs:,} subsecuencias."
-            )
 
-        start = time.perf_counter()
-        seq_id = await self.repo.insert_sequence(canon)
+        timed = logger.isEnabledFor(logging.INFO)
+        start = time.perf_counter() if timed else 0.0
+        # Un único timestamp por request: secuencia y subsecuencias comparten created_at
+        now = datetime.now(timezone.utc)
+        seq_id = await self.repo.insert_sequence(canon, now=now)
         
-        # Crear todas las subsecuencias
-        subsequences = list(generate_subsequences(canon))
-        total_count = len(subsequences)
-        
-        # Para muchas subsecuencias uso bulk, para pocas inserto una por una
-        bulk_threshold = 100
-        used_bulk = False
-        
-        if total_count >= bulk_threshold:
-            used_bulk = True
-            await self.repo.insert_subsequences_bulk(seq_id, subsequences)
-        else:
-            for subseq in subsequences:
-                await self.repo.upsert_subsequence(seq_id, subseq)
-        
-        duration_ms = round((time.perf_counter() - start) * 1000, 2)
-        self.logger.info(
-            f"create_from_sequence n_items={n} total_subsequences={total_count} "
-            f"used_bulk={used_bulk} duration_ms={duration_ms}"
+        # Las subsecuencias van en streaming hasta el bulk_write: el repositorio
+        # las consume por lotes y el total se conoce de antemano
+        total_count = (1 << n) - 1
+        await self.repo.insert_subsequences_bulk(
+            seq_id,
+            generate_subsequences(canon),
+            items_hashes=generate_subsequence_keys(canon),
+            now=now,
         )
+
+        if timed:
+            logger.info(
+                "create_from_sequence n_items=%d total_subsequences=%d duration_ms=%.2f",
+                n, total_count, (time.perf_counter() - start) * 1000,
+            )
         return {"id": seq_id, "items": canon, "total_subsequences": total_count}
 
 
     async def list_latest(self, limit: int = 10):
-        start = time.perf_counter()
+        timed = logger.isEnabledFor(logging.INFO)
+        start = time.perf_counter() if timed else 0.0
         docs = await self.repo.latest_grouped(limit=limit)
-        # Ordenar subsecuencias por tamaño y luego alfabéticamente
-        for d in docs:
-            subs = d["subsequences"]
-            subs.sort(key=lambda s: (len(s), s))
-            d["sub_sequences"] = subs
-            d["sequence"] = d.pop("sequence")
-            d.pop("subsequences", None)
-        duration_ms = round((time.perf_counter() - start) * 1000, 2)
-        self.logger.info(
-            f"list_latest limit={limit} groups={len(docs)} duration_ms={duration_ms}"
-        )
+        # El repositorio ya devuelve las subsecuencias por tamaño y luego
+        # lexicográficamente (rank), no hace falta ordenarlas acá.
+        # Misma forma que SubsequenceListItem: la ruta responde sin re-validar
+        docs = [{"sequence": d["sequence"], "sub_sequences": d["subsequences"]} for d in docs]
+        if timed:
+            logger.info(
+                "list_latest limit=%d groups=%d duration_ms=%.2f",
+                limit, len(docs), (time.perf_counter() - start) * 1000,
+            )
         return docs
\ No newline at end of file
@@ -0,0 +1,43 @@
+"""
+Migración única: completa subsequences.rank en documentos creados antes de que existiera.
+
+latest_grouped ordena por rank (tamaño y luego lexicográfico) en lugar de ordenar
+en Python. Para cada secuencia con documentos sin rank se recalcula el orden de
+todo el grupo. Es idempotente: solo procesa grupos con algún documento sin rank.
+
+Uso:
+    MONGODB_URI=mongodb://localhost:27017 MONGODB_DB=seqdb \
+        python scripts/backfill_subsequence_rank.py
+"""
+import os
+
+from pymongo import MongoClient, UpdateOne
+
+MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
+DB_NAME = os.getenv("MONGODB_DB", "seqdb")
+COL_SUB = os.getenv("MONGODB_SUBSEQ_COL", "subsequences")
+BATCH_SIZE = 1000
+
+
+def main() -> None:
+    client = MongoClient(MONGODB_URI)
+    collection = client[DB_NAME][COL_SUB]
+
+    sequence_ids = collection.distinct("sequence_id", {"rank": {"$exists": False}})
+    updated = 0
+    for sequence_id in sequence_ids:
+        docs = list(collection.find({"sequence_id": sequence_id}, {"items": 1}))
+        docs.sort(key=lambda d: (len(d["items"]), d["items"]))
+        operations = [
+            UpdateOne({"_id": doc["_id"]}, {"$set": {"rank": rank}})
+            for rank, doc in enumerate(docs)
+        ]
+        for i in range(0, len(operations), BATCH_SIZE):
+            result = collection.bulk_write(operations[i : i + BATCH_SIZE], ordered=False)
+            updated += result.modified_count
+
+    print(f"secuencias={len(sequence_ids)} subsecuencias_actualizadas={updated}")
+
+
+if __name__ == "__main__":
+    main()
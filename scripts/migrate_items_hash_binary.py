@@ -0,0 +1,81 @@
+"""
+Migración única: recalcula subsequences.items_hash a partir de `items`.
+
+items_hash cambió de formato varias veces (SHA-256 hex de los elementos ordenados,
+BLAKE2b hex, XOR de BLAKE2b en hex y en binario sin clave). Ninguno se puede
+convertir al actual (XOR de BLAKE2b con ITEMS_HASH_KEY, 16 bytes en BSON binary),
+así que se recalcula con _hash_items(doc["items"]). Sin esta migración un hash viejo
+nunca coincide con uno nuevo y la misma subsecuencia se guardaría dos veces.
+
+Si el hash recalculado ya existe en otro documento, este es un duplicado de la
+misma subsecuencia: se elimina y se informa su _id. Es idempotente: solo escribe
+los documentos cuyo hash difiere del recalculado.
+
+Uso:
+    MONGODB_URI=mongodb://localhost:27017 MONGODB_DB=seqdb ITEMS_HASH_KEY=... \
+        python scripts/migrate_items_hash_binary.py
+"""
+import os
+import sys
+
+from bson import Binary
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError
+
+# Reutilizar el mismo _hash_items que la API (requiere ITEMS_HASH_KEY)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.repositories.subsequence_repo import _hash_items  # noqa: E402
+
+MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
+DB_NAME = os.getenv("MONGODB_DB", "seqdb")
+COL_SUB = os.getenv("MONGODB_SUBSEQ_COL", "subsequences")
+BATCH_SIZE = 1000
+DUPLICATE_KEY = 11000
+
+
+def main() -> None:
+    client = MongoClient(MONGODB_URI)
+    collection = client[DB_NAME][COL_SUB]
+
+    updated = unchanged = 0
+    removed = []
+    operations = []
+    ids = []  # _id de cada operación, en el mismo orden
+
+    def flush() -> None:
+        nonlocal updated
+        try:
+            result = collection.bulk_write(operations, ordered=False)
+            updated += result.modified_count
+        except BulkWriteError as exc:
+            # Otro documento ya tiene el hash recalculado: este es el duplicado
+            errors = exc.details.get("writeErrors", [])
+            if any(err.get("code") != DUPLICATE_KEY for err in errors):
+                raise
+            updated += exc.details.get("nModified", 0)
+            losers = [ids[err["index"]] for err in errors]
+            collection.delete_many({"_id": {"$in": losers}})
+            removed.extend(losers)
+        operations.clear()
+        ids.clear()
+
+    cursor = collection.find({}, {"items": 1, "items_hash": 1})
+    for doc in cursor:
+        h = _hash_items(doc["items"])
+        if doc.get("items_hash") == h:
+            unchanged += 1
+            continue
+        operations.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"items_hash": Binary(h)}}))
+        ids.append(doc["_id"])
+        if len(operations) >= BATCH_SIZE:
+            flush()
+    if operations:
+        flush()
+
+    print(f"actualizados={updated} sin_cambios={unchanged} duplicados_eliminados={len(removed)}")
+    for _id in removed:
+        print(f"  eliminado {_id}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""
+Migración única: convierte subsequences.sequence_id de string a ObjectId.
+
+Versiones anteriores guardaban sequence_id como string en el camino bulk.
+latest_grouped ahora busca por ObjectId, así que esos documentos dejarían
+de aparecer hasta migrarlos. Es idempotente: solo toca los que siguen en string.
+
+Uso:
+    MONGODB_URI=mongodb://localhost:27017 MONGODB_DB=seqdb python scripts/migrate_sequence_id.py
+"""
+import os
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import MongoClient, UpdateOne
+
+MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
+DB_NAME = os.getenv("MONGODB_DB", "seqdb")
+COL_SUB = os.getenv("MONGODB_SUBSEQ_COL", "subsequences")
+BATCH_SIZE = 1000
+
+
+def main() -> None:
+    client = MongoClient(MONGODB_URI)
+    collection = client[DB_NAME][COL_SUB]
+
+    migrated = 0
+    skipped = 0
+    operations = []
+    cursor = collection.find({"sequence_id": {"$type": "string"}}, {"sequence_id": 1})
+    for doc in cursor:
+        try:
+            oid = ObjectId(doc["sequence_id"])
+        except InvalidId:
+            skipped += 1
+            continue
+        operations.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"sequence_id": oid}}))
+        if len(operations) >= BATCH_SIZE:
+            migrated += collection.bulk_write(operations, ordered=False).modified_count
+            operations = []
+    if operations:
+        migrated += collection.bulk_write(operations, ordered=False).modified_count
+
+    print(f"sequence_id migrados={migrated} no_convertibles={skipped}")
+
+
+if __name__ == "__main__":
+    main()
@@ -151,6 +151,10 @@ resource "aws_ecs_task_definition" "api" {
           name  = "JWT_SECRET"
           value = var.jwt_secret
         },
+        {
+          name  = "ITEMS_HASH_KEY"
+          value = var.items_hash_key
+        },
         {
           name  = "JWT_ALGORITHM"
           value = "HS256"
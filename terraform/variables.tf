@@ -64,6 +64,12 @@ variable "jwt_secret" {
   sensitive   = true
 }
 
+variable "items_hash_key" {
+  description = "Secret key for subsequence items_hash (max 64 bytes)"
+  type        = string
+  sensitive   = true
+}
+
 variable "ecr_repository_url" {
   description = "ECR repository URL for the API image"
   type        = string
@@ -3,14 +3,16 @@ Fixtures y configuración para los tests.
 """
 import asyncio
 import os
+from types import SimpleNamespace
 from typing import AsyncGenerator, Generator
 
 # Configurar variables de entorno antes de importar módulos que las usan
 os.environ.setdefault("JWT_SECRET", "test-secret")
+os.environ.setdefault("ITEMS_HASH_KEY", "test-items-hash-key")
 
 import pytest
 from bson import ObjectId
-from httpx import AsyncClient
+from httpx import ASGITransport, AsyncClient
 
 
 @pytest.fixture(autouse=True)
@@ -87,14 +89,24 @@ def event_loop() -> Generator:
     loop.close()
 
 
+@pytest.fixture(scope="session")
+async def http_client() -> AsyncGenerator:
+    """AsyncClient + transporte ASGI compartidos por toda la sesión."""
+    from app.main import app
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+        yield ac
+
+
 @pytest.fixture
-async def client(mock_mongodb) -> AsyncGenerator:
+async def client(mock_mongodb, http_client: AsyncClient) -> AsyncClient:
     """Cliente HTTP async para tests de endpoints."""
-    # Importar la app después de aplicar los mocks asegura que `app.main`
-    # resuelva `get_db/ensure_indexes` ya parcheados.
+    # El cliente es de sesión pero el estado no: `mock_mongodb` ya parcheó
+    # `get_db/ensure_indexes` (también en `app.main`) para este test.
     from app.main import app
-    async with AsyncClient(app=app, base_url="http://test") as ac:
-        yield ac
+    # httpx no emite eventos lifespan: ejecutar el startup a mano (índices + servicio)
+    # para que el servicio y /health queden ligados a la base fake de este test
+    await app.router.startup()
+    return http_client
 
 
 @pytest.fixture
@@ -105,145 +117,181 @@ async def auth_headers(client: AsyncClient) -> dict:
     return {"Authorization": f"Bearer {token}"}
 
 
+# --- Fake de MongoDB (a nivel de módulo: las clases se definen una sola vez por
+# sesión; cada test recibe una FakeDB nueva en `mock_mongodb`) ---
+
+class FakeDocument(dict):
+    """Simula un documento MongoDB con _id"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if "_id" not in self:
+            self["_id"] = ObjectId()
+
+
+def matches(doc, filter_dict):
+    """Soporta igualdad y {"$in": [...]}"""
+    for k, v in filter_dict.items():
+        if isinstance(v, dict) and "$in" in v:
+            if doc.get(k) not in v["$in"]:
+                return False
+        elif doc.get(k) != v:
+            return False
+    return True
+
+
+def project(doc, projection):
+    """Proyección de inclusión estilo MongoDB (_id incluido salvo _id: 0)"""
+    if not projection:
+        return doc
+    fields = {k for k, v in projection.items() if v}
+    if projection.get("_id", 1):
+        fields.add("_id")
+    return {k: v for k, v in doc.items() if k in fields}
+
+
+class FakeCursor:
+    """Simula un cursor de Motor (sort/limit/to_list/async for)"""
+    def __init__(self, docs, projection=None):
+        self.docs = list(docs)
+        # Como en MongoDB, se puede ordenar por campos no proyectados
+        self.projection = projection
+
+    def sort(self, key, direction=1):
+        keys = key if isinstance(key, list) else [(key, direction)]
+        # Sort estable: aplicar las claves de la menos a la más significativa
+        for field, dirn in reversed(keys):
+            self.docs.sort(key=lambda d, f=field: d.get(f), reverse=dirn < 0)
+        return self
+
+    def limit(self, n):
+        if n:
+            self.docs = self.docs[:n]
+        return self
+
+    async def to_list(self, length=None):
+        docs = self.docs[:length] if length else self.docs
+        return [project(d, self.projection) for d in docs]
+
+    def __aiter__(self):
+        self._iter = (project(d, self.projection) for d in self.docs)
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._iter)
+        except StopIteration:
+            raise StopAsyncIteration from None
+
+
+class FakeCollection(list):
+    """Simula una colección MongoDB"""
+    def __init__(self, name=""):
+        super().__init__()
+        self.name = name
+        self.indexes = []
+        # Índice items_hash -> documento: upserts por hash en O(1)
+        self.by_hash = {}
+
+    def _store(self, doc):
+        self.append(doc)
+        if "items_hash" in doc:
+            self.by_hash.setdefault(doc["items_hash"], doc)
+
+    def _exists(self, filter_dict):
+        if filter_dict.keys() == {"items_hash"}:
+            return filter_dict["items_hash"] in self.by_hash
+        return any(matches(doc, filter_dict) for doc in self)
+    
+    async def insert_one(self, document):
+        """Simula insert_one de MongoDB"""
+        doc = FakeDocument(document)
+        if "_id" not in doc:
+            doc["_id"] = ObjectId()
+        self._store(doc)
+        return SimpleNamespace(inserted_id=doc["_id"])
+    
+    async def update_one(self, filter_dict, update, upsert=False):
+        """Simula update_one de MongoDB (solo upsert con $setOnInsert)"""
+        if self._exists(filter_dict):
+            return SimpleNamespace(matched_count=1, modified_count=0, upserted_id=None)
+        if not upsert:
+            return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=None)
+        doc = FakeDocument(update.get("$setOnInsert", {}))
+        self._store(doc)
+        return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=doc["_id"])
+
+    async def find_one(self, filter_dict):
+        """Simula find_one de MongoDB"""
+        for doc in self:
+            if all(doc.get(k) == v for k, v in filter_dict.items()):
+                return doc
+        return None
+    
+    def find(self, filter_dict=None, projection=None):
+        """Simula find de MongoDB (devuelve un cursor, como Motor)"""
+        docs = [d for d in self if matches(d, filter_dict or {})]
+        return FakeCursor(docs, projection)
+    
+    async def create_index(self, keys, **kwargs):
+        """Simula create_index de MongoDB"""
+        self.indexes.append({"keys": keys, "options": kwargs})
+        return f"index_{len(self.indexes)}"
+    
+    async def bulk_write(self, operations, ordered=False):
+        """Simula bulk_write de MongoDB"""
+        # Simular procesamiento de operaciones UpdateOne
+        processed_count = 0
+        for op in operations:
+            # Soporte para UpdateOne de pymongo
+            if hasattr(op, '_filter') and hasattr(op, '_doc'):
+                filter_dict = op._filter
+                update_dict = op._doc
+                # Verificar existencia por filtro exacto (índice si es por hash)
+                exists = self._exists(filter_dict)
+                if not exists and '$setOnInsert' in update_dict:
+                    new_doc = update_dict['$setOnInsert'].copy()
+                    if '_id' not in new_doc:
+                        new_doc['_id'] = ObjectId()
+                    self._store(new_doc)
+                    processed_count += 1
+            else:
+                # Otras operaciones (InsertOne, etc.)
+                processed_count += 1
+        
+        return SimpleNamespace(
+            upserted_count=processed_count,
+            modified_count=0,
+            inserted_count=0,
+            matched_count=0,
+            deleted_count=0,
+        )
+
+
+class FakeDB(dict):
+    """Simula una base de datos MongoDB"""
+    def __init__(self):
+        super().__init__()
+        self["sequences"] = FakeCollection("sequences")
+        self["subsequences"] = FakeCollection("subsequences")
+    
+    def __getitem__(self, key):
+        if key not in self:
+            self[key] = FakeCollection(key)
+        return super().__getitem__(key)
+    
+    async def command(self, command):
+        """Simula el comando ping de MongoDB para health checks"""
+        if command == "ping":
+            return {"ok": 1.0}
+        raise Exception(f"Comando no soportado: {command}")
+
+
 @pytest.fixture(autouse=True)
 def mock_mongodb(monkeypatch):
     """
     Mock completo de MongoDB para tests.
     Simula las colecciones sequences y subsequences.
     """
-    class FakeDocument(dict):
-        """Simula un documento MongoDB con _id"""
-        def __init__(self, *args, **kwargs):
-            super().__init__(*args, **kwargs)
-            if "_id" not in self:
-                self["_id"] = ObjectId()
-    
-    class FakeCollection(list):
-        """Simula una colección MongoDB"""
-        def __init__(self, name=""):
-            super().__init__()
-            self.name = name
-            self.indexes = []
-        
-        async def insert_one(self, document):
-            """Simula insert_one de MongoDB"""
-            doc = FakeDocument(document)
-            if "_id" not in doc:
-                doc["_id"] = ObjectId()
-            self.append(doc)
-            
-            class InsertResult:
-                def __init__(self, inserted_id):
-                    self.inserted_id = inserted_id
-            
-            return InsertResult(doc["_id"])
-        
-        async def find_one(self, filter_dict):
-            """Simula find_one de MongoDB"""
-            for doc in self:
-                if all(doc.get(k) == v for k, v in filter_dict.items()):
-                    return doc
-            return None
-        
-        async def find(self, filter_dict=None):
-            """Simula find de MongoDB"""
-            if filter_dict is None:
-                return self
-            
-            results = []
-            for doc in self:
-                if all(doc.get(k) == v for k, v in filter_dict.items()):
-                    results.append(doc)
-            return results
-        
-        async def create_index(self, keys, **kwargs):
-            """Simula create_index de MongoDB"""
-            self.indexes.append({"keys": keys, "options": kwargs})
-            return f"index_{len(self.indexes)}"
-        
-        async def bulk_write(self, operations, ordered=False):
-            """Simula bulk_write de MongoDB"""
-            class BulkWriteResult:
-                def __init__(self, ops_count):
-                    self.upserted_count = ops_count
-                    self.modified_count = 0
-                    self.inserted_count = 0
-                    self.matched_count = 0
-                    self.deleted_count = 0
-            
-            # Simular procesamiento de operaciones UpdateOne
-            processed_count = 0
-            for op in operations:
-                # Soporte para UpdateOne de pymongo
-                if hasattr(op, '_filter') and hasattr(op, '_doc'):
-                    filter_dict = op._filter
-                    update_dict = op._doc
-                    # Verificar existencia por filtro exacto
-                    exists = any(
-                        all(doc.get(k) == v for k, v in filter_dict.items()) 
-                        for doc in self
-                    )
-                    if not exists and '$setOnInsert' in update_dict:
-                        new_doc = update_dict['$setOnInsert'].copy()
-                        if '_id' not in new_doc:
-                            new_doc['_id'] = ObjectId()
-                        self.append(new_doc)
-                        processed_count += 1
-                else:
-                    # Otras operaciones (InsertOne, etc.)
-                    processed_count += 1
-            
-            return BulkWriteResult(processed_count)
-        
-        def aggregate(self, pipeline):
-            """Simula aggregate de MongoDB"""
-            # Simulación básica para tests
-            class AsyncCursor:
-                def __init__(self, data):
-                    self.data = data
-                    self.index = 0
-                
-                def __aiter__(self):
-                    return self
-                
-                async def __anext__(self):
-                    if self.index >= len(self.data):
-                        raise StopAsyncIteration
-                    item = self.data[self.index]
-                    self.index += 1
-                    return item
-            
-            # Datos de prueba para aggregate
-            test_data = [
-                {
-                    "sequence": [1, 2, 3],
-                    "subsequences": [[1], [2], [3], [1, 2], [1, 3], [2, 3], [1, 2, 3]]
-                },
-                {
-                    "sequence": [4, 5],
-                    "subsequences": [[4], [5], [4, 5]]
-                }
-            ]
-            return AsyncCursor(test_data)
-    
-    class FakeDB(dict):
-        """Simula una base de datos MongoDB"""
-        def __init__(self):
-            super().__init__()
-            self["sequences"] = FakeCollection("sequences")
-            self["subsequences"] = FakeCollection("subsequences")
-        
-        def __getitem__(self, key):
-            if key not in self:
-                self[key] = FakeCollection(key)
-            return super().__getitem__(key)
-        
-        async def command(self, command):
-            """Simula el comando ping de MongoDB para health checks"""
-            if command == "ping":
-                return {"ok": 1.0}
-            raise Exception(f"Comando no soportado: {command}")
-    
     # Patchear las funciones de mongo.py
     from app.db import mongo as mongo_mod
     
@@ -257,7 +305,7 @@ def mock_mongodb(monkeypatch):
         await db["sequences"].create_index([("created_at", -1)])
         await db["subsequences"].create_index("items_hash", unique=True)
         await db["subsequences"].create_index([("created_at", -1)])
-        await db["subsequences"].create_index("sequence_id")
+        await db["subsequences"].create_index([("sequence_id", 1), ("rank", 1)])
     
     monkeypatch.setattr(mongo_mod, "get_db", fake_get_db)
     monkeypatch.setattr(mongo_mod, "ensure_indexes", fake_ensure_indexes)
@@ -269,13 +317,6 @@ def mock_mongodb(monkeypatch):
         monkeypatch.setattr(app_main, "ensure_indexes", fake_ensure_indexes, raising=False)
     except Exception:
         pass
-
-    # Si `app.api.routes` ya fue importado, parchear su referencia a get_db
-    try:
-        import app.api.routes as routes_mod
-        monkeypatch.setattr(routes_mod, "get_db", fake_get_db, raising=False)
-    except Exception:
-        pass
     
     return fake_db
 
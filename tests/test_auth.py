@@ -1,4 +1,8 @@
 import asyncio
+import base64
+import hashlib
+import hmac
+import time
 from datetime import datetime, timedelta, timezone
 
 import jwt
@@ -114,22 +118,286 @@ class TestJWTToken:
         with pytest.raises(jwt.ExpiredSignatureError):
             jwt.decode(expired_token, JWT_SECRET, algorithms=[JWT_ALG])
     
-    def test_malformed_token_validation(self):
-        """Verifica que tokens malformados son rechazados"""
-        malformed_tokens = [
+    @pytest.mark.parametrize(
+        "bad_token",
+        [
             "not.a.token",
             "invalid",
             "",
             "eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVCJ9",  # Solo header
             "eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVCJ9.eyJzdWIiOiIxMjM0NTY3ODkwIn0",  # Sin signature
-        ]
-        
-        for bad_token in malformed_tokens:
+        ],
+    )
+    def test_malformed_token_validation(self, bad_token):
+        """Verifica que tokens malformados son rechazados (PyJWT y camino rápido)"""
+        from app.core.security import _decode_fast
+
+        with pytest.raises(jwt.InvalidTokenError):
+            jwt.decode(bad_token, JWT_SECRET, algorithms=[JWT_ALG])
+        with pytest.raises(jwt.InvalidTokenError):
+            _decode_fast(bad_token)
+
+
+
+class TestJWTGuardCache:
+    """Tests del cache de verificación de tokens en jwt_guard"""
+
+    @staticmethod
+    def _credentials(token):
+        from fastapi.security import HTTPAuthorizationCredentials
+
+        return HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+
+    def test_valid_token_is_decoded_once(self, monkeypatch):
+        """Un token ya verificado no vuelve a decodificarse"""
+        from app.core import security
+
+        token = create_access_token()
+        calls = []
+        real_decode = security._decode
+
+        def counting_decode(raw):
+            calls.append(raw)
+            return real_decode(raw)
+
+        monkeypatch.setattr(security, "_decode", counting_decode)
+
+        assert security.jwt_guard(self._credentials(token)) is True
+        assert security.jwt_guard(self._credentials(token)) is True
+        assert calls == [token]
+
+    def test_cache_stores_only_expiration(self):
+        """El cache guarda el vencimiento acotado, nunca el token"""
+        from app.core import security
+
+        token = create_access_token()
+        security.jwt_guard(self._credentials(token))
+
+        # Las claves son digests de 16 bytes y los valores timestamps: el token no aparece
+        raw = token.encode()
+        assert security._verified_tokens
+        for key, value in security._verified_tokens.items():
+            assert isinstance(key, bytes) and len(key) == 16
+            assert raw not in key and key not in raw
+            assert isinstance(value, (int, float))
+        decoded = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALG])
+        valid_until = max(security._verified_tokens.values())
+        assert valid_until <= decoded["exp"]
+
+    def test_cache_evicts_least_recently_used(self, monkeypatch):
+        """Al llenarse, el cache descarta solo el token menos usado"""
+        from app.core import security
+
+        monkeypatch.setattr(security, "_TOKEN_CACHE_MAXSIZE", 2)
+        security._verified_tokens.clear()
+        first, second, third = (create_access_token() for _ in range(3))
+
+        security.jwt_guard(self._credentials(first))
+        security.jwt_guard(self._credentials(second))
+        security.jwt_guard(self._credentials(first))  # first pasa a ser el más reciente
+        security.jwt_guard(self._credentials(third))
+
+        def cache_key(token):
+            return hashlib.sha256(token.encode()).digest()[:16]
+
+        assert list(security._verified_tokens) == [cache_key(first), cache_key(third)]
+
+    def test_cache_is_thread_safe(self, monkeypatch):
+        """Muchos hilos con el mismo token y entradas vencidas: nunca KeyError"""
+        from collections import OrderedDict
+        from concurrent.futures import ThreadPoolExecutor
+
+        from app.core import security
+
+        class YieldingCache(OrderedDict):
+            # Cede el GIL entre el get y el del/move_to_end para abrir la ventana de carrera
+            def get(self, key, default=None):
+                value = super().get(key, default)
+                time.sleep(0.0001)
+                return value
+
+        # TTL 0: cada acceso encuentra la entrada vencida y la borra/reinserta
+        monkeypatch.setattr(security, "_verified_tokens", YieldingCache())
+        monkeypatch.setattr(security, "_TOKEN_CACHE_TTL", 0)
+        monkeypatch.setattr(security, "_TOKEN_CACHE_MAXSIZE", 2)
+        tokens = [create_access_token() for _ in range(3)]
+        credentials = [self._credentials(t) for t in tokens]
+
+        def hammer(i):
+            for j in range(50):
+                assert security.jwt_guard(credentials[j % len(credentials)]) is True
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(hammer, range(8)))
+
+        assert len(security._verified_tokens) <= 2
+
+    def test_expired_token_is_not_cached(self):
+        """Los tokens inválidos o expirados nunca entran al cache"""
+        from fastapi import HTTPException
+
+        from app.core import security
+
+        now = datetime.now(timezone.utc)
+        payload = {
+            "sub": "api-client",
+            "iat": int((now - timedelta(minutes=11)).timestamp()),
+            "exp": int((now - timedelta(seconds=1)).timestamp()),
+        }
+        expired_token = jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALG)
+        future_iat = jwt.encode(
+            {
+                "sub": "api-client",
+                "iat": int((now + timedelta(days=1)).timestamp()),
+                "exp": int((now + timedelta(days=1, minutes=10)).timestamp()),
+            },
+            JWT_SECRET,
+            algorithm=JWT_ALG,
+        )
+        security._verified_tokens.clear()
+
+        for bad_token in (expired_token, future_iat, "invalid"):
+            with pytest.raises(HTTPException) as exc_info:
+                security.jwt_guard(self._credentials(bad_token))
+            assert exc_info.value.status_code == status.HTTP_401_UNAUTHORIZED
+
+        assert security._verified_tokens == {}
+
+    def test_guard_errors_are_fresh_instances(self):
+        """Cada rechazo es una excepción nueva con el detalle fijo"""
+        from app.core import security
+
+        errors = []
+        for _ in range(2):
+            with pytest.raises(security.TokenInvalidError) as exc_info:
+                security.jwt_guard(self._credentials("invalid"))
+            errors.append(exc_info.value)
+
+        assert errors[0] is not errors[1]
+        assert all(e.status_code == status.HTTP_401_UNAUTHORIZED for e in errors)
+        assert all(e.detail == "Token inválido" for e in errors)
+
+
+class TestFastDecode:
+    """Tests del decode HS256 a mano"""
+
+    def test_matches_pyjwt(self):
+        """El camino rápido devuelve el mismo payload que jwt.decode"""
+        from app.core.security import _decode_fast
+
+        token = create_access_token()
+        assert _decode_fast(token) == jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALG])
+
+    def test_manual_encode_matches_pyjwt(self):
+        """create_access_token firma igual que jwt.encode con el mismo payload"""
+        token = create_access_token()
+        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALG])
+        assert jwt.get_unverified_header(token) == {"alg": "HS256", "typ": "JWT"}
+        assert token == jwt.encode(payload, JWT_SECRET, algorithm="HS256")
+
+    def test_same_second_tokens_stay_unique(self):
+        """El prefijo de claims se reutiliza por segundo pero el jti no"""
+        tokens = [create_access_token() for _ in range(5)]
+        payloads = [jwt.decode(t, JWT_SECRET, algorithms=[JWT_ALG]) for t in tokens]
+        assert len(set(tokens)) == 5
+        assert len({p["jti"] for p in payloads}) == 5
+
+    def test_rejects_tampered_and_foreign_tokens(self):
+        """Firma alterada, otra clave u otro algoritmo se rechazan"""
+        from app.core.security import _decode_fast
+
+        token = create_access_token()
+        header, payload, signature = token.split(".")
+        tampered = f"{header}.{payload}.{signature[:-2]}AA"
+        foreign = jwt.encode({"sub": "x"}, "another-secret", algorithm="HS256")
+        hs512 = jwt.encode({"sub": "x"}, JWT_SECRET, algorithm="HS512")
+
+        no_exp = jwt.encode({"sub": "api-client", "iat": int(time.time())}, JWT_SECRET)
+
+        for bad in (tampered, foreign, hs512, no_exp, "a.b", "not-a-token"):
             with pytest.raises(jwt.InvalidTokenError):
-                jwt.decode(bad_token, JWT_SECRET, algorithms=[JWT_ALG])
+                _decode_fast(bad)
+
+    def test_rejects_expired_and_non_numeric_exp(self):
+        """exp vencido o no numérico se rechaza igual que en PyJWT"""
+        from app.core.security import _decode_fast
+
+        now = int(time.time())
+        expired = jwt.encode(
+            {"sub": "api-client", "iat": now - 60, "exp": now - 1}, JWT_SECRET, algorithm="HS256"
+        )
+        with pytest.raises(jwt.ExpiredSignatureError):
+            _decode_fast(expired)
+
+        header, _, _ = expired.split(".")
+        body = base64.urlsafe_b64encode(
+            b'{"sub":"api-client","iat":0,"exp":"soon"}'
+        ).rstrip(b"=").decode()
+        signature = base64.urlsafe_b64encode(
+            hmac.new(JWT_SECRET.encode(), f"{header}.{body}".encode(), hashlib.sha256).digest()
+        ).rstrip(b"=").decode()
+        with pytest.raises(jwt.DecodeError):
+            _decode_fast(f"{header}.{body}.{signature}")
+
+
+    @pytest.mark.parametrize(
+        "claims",
+        [
+            {"iat": 0, "exp": 600},  # válido
+            {"iat": 86400, "exp": 90000},  # iat en el futuro
+            {"iat": 0, "exp": 600, "nbf": 60},  # nbf en el futuro
+            {"iat": 0, "exp": 600, "nbf": -60},  # nbf ya alcanzado
+            {"iat": -60, "exp": 0},  # exp == now
+            {"iat": -0.5, "exp": 600.5},  # claims float
+            {"iat": 0, "exp": 0.9},  # exp float que int() trunca a now
+            {"iat": "0", "exp": "600"},  # claims string numéricos
+            {"iat": 0, "exp": "soon"},  # exp string no numérico
+            {"iat": "ayer", "exp": 600},  # iat string no numérico
+            {"iat": None, "exp": 600},  # claim requerido nulo
+        ],
+    )
+    def test_edge_cases_match_pyjwt(self, claims, monkeypatch):
+        """Cada token de borde se acepta o rechaza igual que en jwt.decode"""
+        from types import SimpleNamespace
 
+        import jwt.api_jwt
 
+        from app.core import security
 
+        # Reloj fijo para que "now" sea el mismo en ambos caminos
+        now = int(time.time())
+
+        class FrozenDatetime(datetime):
+            @classmethod
+            def now(cls, tz=None):
+                return datetime.fromtimestamp(now, tz)
+
+        monkeypatch.setattr(security, "time", SimpleNamespace(time=lambda: float(now)))
+        monkeypatch.setattr(jwt.api_jwt, "datetime", FrozenDatetime)
+
+        payload = {"sub": "api-client"}
+        for claim, offset in claims.items():
+            if isinstance(offset, (int, float)):
+                payload[claim] = now + offset
+            elif isinstance(offset, str) and offset.isdigit():
+                payload[claim] = str(now + int(offset))
+            else:
+                payload[claim] = offset
+        token = jwt.encode(payload, JWT_SECRET, algorithm="HS256")
+
+        def accepts(decode):
+            try:
+                decode(token)
+            except Exception:
+                return False
+            return True
+
+        def pyjwt_decode(t):
+            return jwt.decode(
+                t, JWT_SECRET, algorithms=["HS256"], options={"require": ["exp", "iat", "sub"]}
+            )
+
+        assert accepts(security._decode_fast) == accepts(pyjwt_decode)
 
 class TestAuthEndpoint:
     """Tests del endpoint /auth/token"""
@@ -197,10 +465,8 @@ class TestAuthEndpoint:
         for _ in range(5):
             response = await client.post("/auth/token")
             token = response.json()["access_token"]
+            # Sin pausas: el jti hace únicos incluso los tokens del mismo segundo
             tokens.append(token)
-            
-            # Pequeña pausa para asegurar diferentes timestamps
-            await asyncio.sleep(0.1)
         
         # Todos deben ser únicos
         assert len(tokens) == len(set(tokens))
@@ -222,13 +488,14 @@ class TestAuthEndpoint:
         assert decode_success
     
     @pytest.mark.asyncio
-    async def test_concurrent_token_generation(self, client):
-        """Verifica que múltiples requests concurrentes funcionan correctamente"""
-        import asyncio
-        
+    async def test_concurrent_token_generation(self):
+        """Verifica que múltiples llamadas concurrentes al handler funcionan correctamente"""
+        from app.api.routes import issue_token
+
+        # Directo al handler (sin HTTP): igual que FastAPI, en el threadpool.
+        # El camino HTTP completo ya lo cubre test_token_endpoint_success.
         async def get_token():
-            response = await client.post("/auth/token")
-            return response.json()["access_token"]
+            return (await asyncio.to_thread(issue_token))["access_token"]
         
         # Generar 10 tokens concurrentemente
         tokens = await asyncio.gather(*[get_token() for _ in range(10)])
@@ -1,70 +1,91 @@
-from unittest.mock import AsyncMock, MagicMock
+from dataclasses import dataclass, field
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
 
 import pytest
+from bson import ObjectId
 
 from app.repositories.subsequence_repo import SubsequenceRepository
 from app.services.subsequence_service import SubsequenceService
 
 
+@dataclass
+class SpyCollection:
+    """Colección mínima que registra las llamadas a bulk_write (sin MagicMock)"""
+
+    calls: list = field(default_factory=list)
+    upserted_count: int | None = None
+
+    async def bulk_write(self, operations, ordered=True):
+        self.calls.append((operations, ordered))
+        upserted = len(operations) if self.upserted_count is None else self.upserted_count
+        return SimpleNamespace(upserted_count=upserted, modified_count=0)
+
+
+@dataclass
+class SpyDB:
+    """Base de datos que devuelve siempre la misma colección y anota los accesos"""
+
+    collection: SpyCollection = field(default_factory=SpyCollection)
+    accessed: list = field(default_factory=list)
+
+    def __getitem__(self, name):
+        self.accessed.append(name)
+        return self.collection
+
+
 class TestBulkWriteRepository:
     """Tests para el método bulk_write del repositorio"""
     
     @pytest.mark.asyncio
     async def test_insert_subsequences_bulk_empty_list(self):
         """Test que bulk_write maneja lista vacía correctamente"""
-        mock_db = MagicMock()
-        repo = SubsequenceRepository(mock_db)
+        spy_db = SpyDB()
+        repo = SubsequenceRepository(spy_db)
         
         result = await repo.insert_subsequences_bulk("seq123", [])
         assert result == 0
-        mock_db.__getitem__.assert_not_called()
+        assert spy_db.accessed == []
     
     @pytest.mark.asyncio
     async def test_insert_subsequences_bulk_success(self):
         """Test que bulk_write inserta subsecuencias correctamente"""
-        # Mock de la colección con bulk_write
-        mock_collection = MagicMock()
-        mock_result = MagicMock()
-        mock_result.upserted_count = 3
-        mock_result.modified_count = 0
-        mock_collection.bulk_write = AsyncMock(return_value=mock_result)
-        
-        mock_db = MagicMock()
-        mock_db.__getitem__.return_value = mock_collection
-        
-        repo = SubsequenceRepository(mock_db)
+        collection = SpyCollection(upserted_count=3)
+        repo = SubsequenceRepository(SpyDB(collection))
         subsequences = [[1], [2], [1, 2]]
         
         result = await repo.insert_subsequences_bulk("seq123", subsequences)
         
         assert result == 3
-        mock_collection.bulk_write.assert_called_once()
+        assert len(collection.calls) == 1
         
         # Verificar que se llamó con ordered=False
-        call_args = mock_collection.bulk_write.call_args
-        assert call_args[1]['ordered'] is False
-        assert len(call_args[0][0]) == 3  # 3 operaciones UpdateOne
+        operations, ordered = collection.calls[0]
+        assert ordered is False
+        assert len(operations) == 3  # 3 operaciones UpdateOne
     
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("bad", [[1, 1], [2, 1]])
+    async def test_insert_subsequences_bulk_rejects_non_canonical(self, bad):
+        """Sin items_hashes, cada subsecuencia debe ser estrictamente creciente"""
+        db = SpyDB()
+        repo = SubsequenceRepository(db)
+
+        with pytest.raises(ValueError):
+            await repo.insert_subsequences_bulk("seq123", [[1], bad])
+        assert db.collection.calls == []
+
     @pytest.mark.asyncio
     async def test_insert_subsequences_bulk_operations_structure(self):
         """Test que las operaciones UpdateOne tienen la estructura correcta"""
-        mock_collection = MagicMock()
-        mock_result = MagicMock()
-        mock_result.upserted_count = 2
-        mock_result.modified_count = 0
-        mock_collection.bulk_write = AsyncMock(return_value=mock_result)
-        
-        mock_db = MagicMock()
-        mock_db.__getitem__.return_value = mock_collection
-        
-        repo = SubsequenceRepository(mock_db)
+        collection = SpyCollection()
+        repo = SubsequenceRepository(SpyDB(collection))
         subsequences = [[1], [2]]
         
         await repo.insert_subsequences_bulk("seq123", subsequences)
         
         # Verificar que se crearon operaciones UpdateOne
-        call_args = mock_collection.bulk_write.call_args
-        operations = call_args[0][0]
+        operations, _ = collection.calls[0]
         
         assert len(operations) == 2
         for op in operations:
@@ -76,6 +97,100 @@ class TestBulkWriteRepository:
             assert 'items_hash' in filt
             assert '$setOnInsert' in upd
 
+    @pytest.mark.asyncio
+    async def test_insert_subsequences_bulk_ignores_duplicate_key_errors(self):
+        """Test que los E11000 de upserts concurrentes se ignoran como duplicados"""
+        from pymongo.errors import BulkWriteError
+
+        async def racing_bulk_write(operations, ordered=False):
+            raise BulkWriteError({
+                "writeErrors": [{"index": 0, "code": 11000, "errmsg": "E11000"}],
+                "writeConcernErrors": [],
+                "nUpserted": len(operations) - 1,
+                "nModified": 0,
+            })
+
+        collection = SpyCollection()
+        collection.bulk_write = racing_bulk_write
+        repo = SubsequenceRepository(SpyDB(collection))
+
+        result = await repo.insert_subsequences_bulk("seq123", [[1], [2], [1, 2]])
+        assert result == 2
+
+    @pytest.mark.asyncio
+    async def test_insert_subsequences_bulk_reraises_other_write_errors(self):
+        """Test que otros errores de escritura no se ocultan"""
+        from pymongo.errors import BulkWriteError
+
+        async def failing_bulk_write(operations, ordered=False):
+            raise BulkWriteError({
+                "writeErrors": [{"index": 0, "code": 121, "errmsg": "validation"}],
+                "writeConcernErrors": [],
+                "nUpserted": 0,
+                "nModified": 0,
+            })
+
+        collection = SpyCollection()
+        collection.bulk_write = failing_bulk_write
+        repo = SubsequenceRepository(SpyDB(collection))
+
+        with pytest.raises(BulkWriteError):
+            await repo.insert_subsequences_bulk("seq123", [[1], [2]])
+
+    @pytest.mark.asyncio
+    async def test_insert_subsequences_bulk_chunked_concurrently(self, monkeypatch):
+        """Test que las operaciones se envían en lotes con concurrencia acotada"""
+        import asyncio
+
+        from app.repositories import subsequence_repo
+
+        monkeypatch.setattr(subsequence_repo, "BULK_CHUNK_SIZE", 10)
+        monkeypatch.setattr(subsequence_repo, "BULK_MAX_CONCURRENCY", 2)
+
+        in_flight = 0
+        max_in_flight = 0
+        chunk_sizes = []
+
+        async def fake_bulk_write(operations, ordered=False):
+            nonlocal in_flight, max_in_flight
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+            chunk_sizes.append(len(operations))
+            await asyncio.sleep(0)
+            in_flight -= 1
+            return SimpleNamespace(upserted_count=len(operations), modified_count=0)
+
+        collection = SpyCollection()
+        collection.bulk_write = fake_bulk_write
+
+        repo = SubsequenceRepository(SpyDB(collection))
+        subsequences = [[i] for i in range(1, 46)]
+
+        result = await repo.insert_subsequences_bulk("seq123", subsequences)
+
+        assert result == 45
+        assert chunk_sizes == [10, 10, 10, 10, 5]
+        assert max_in_flight <= 2
+
+    @pytest.mark.asyncio
+    async def test_insert_subsequences_bulk_builds_chunks_off_event_loop(self):
+        """Test que la generación de subsecuencias corre fuera del hilo del event loop"""
+        import threading
+
+        consumer_threads = set()
+
+        def subsequences():
+            for sub in ([1], [2], [1, 2]):
+                consumer_threads.add(threading.get_ident())
+                yield sub
+
+        repo = SubsequenceRepository(SpyDB())
+        result = await repo.insert_subsequences_bulk("seq123", subsequences())
+
+        assert result == 3
+        assert consumer_threads
+        assert threading.get_ident() not in consumer_threads
+
 
 class TestBulkWriteService:
     """Tests para el uso de bulk_write en el servicio"""
@@ -104,8 +219,8 @@ class TestBulkWriteService:
         assert result["items"] == large_sequence
     
     @pytest.mark.asyncio
-    async def test_service_uses_individual_inserts_for_small_sequences(self):
-        """Test que el servicio usa inserts individuales para secuencias pequeñas"""
+    async def test_service_uses_bulk_for_small_sequences(self):
+        """Test que el servicio también usa bulk_write para secuencias pequeñas"""
         mock_repo = AsyncMock()
         mock_repo.insert_sequence.return_value = "seq123"
         mock_repo.insert_subsequences_bulk = AsyncMock()
@@ -113,41 +228,36 @@ class TestBulkWriteService:
         
         service = SubsequenceService(mock_repo)
         
-        # Secuencia pequeña (n=3 -> 7 subsecuencias, menos del umbral de 100)
+        # Secuencia pequeña (n=3 -> 7 subsecuencias)
         small_sequence = [1, 2, 3]
         
         result = await service.create_from_sequence(small_sequence)
         
-        # Verificar que se usaron inserts individuales
-        mock_repo.upsert_subsequence.assert_called()
-        mock_repo.insert_subsequences_bulk.assert_not_called()
-        
-        # Verificar que se llamó upsert_subsequence 7 veces (2^3 - 1)
-        assert mock_repo.upsert_subsequence.call_count == 7
+        # Ya no hay inserts individuales: una sola llamada bulk
+        mock_repo.insert_subsequences_bulk.assert_called_once()
+        mock_repo.upsert_subsequence.assert_not_called()
         assert result["total_subsequences"] == 7
     
     @pytest.mark.asyncio
-    async def test_service_bulk_threshold_boundary(self):
-        """Test el comportamiento en el límite del umbral de bulk"""
+    async def test_service_streams_subsequences_to_repo(self):
+        """Test que el servicio pasa un generador, sin materializar la lista"""
         mock_repo = AsyncMock()
         mock_repo.insert_sequence.return_value = "seq123"
-        mock_repo.insert_subsequences_bulk = AsyncMock()
-        mock_repo.upsert_subsequence = AsyncMock()
+        received = []
+
+        async def consume(seq_id, subsequences, items_hashes=None, now=None):
+            received.append(subsequences)
+            return 0
+
+        mock_repo.insert_subsequences_bulk = AsyncMock(side_effect=consume)
         
         service = SubsequenceService(mock_repo)
+        result = await service.create_from_sequence(list(range(1, 7)))
         
-        # Secuencia que genera exactamente 100 subsecuencias (n=7 -> 127, pero forzamos umbral)
-        # Para testear el límite, necesitamos una secuencia que genere exactamente 100
-        # n=6 -> 63 subsecuencias (menos de 100, usa individual)
-        # n=7 -> 127 subsecuencias (más de 100, usa bulk)
-        
-        # Test con n=6 (debería usar individual)
-        small_sequence = list(range(1, 7))  # [1, 2, 3, 4, 5, 6] -> 63 subsecuencias
-        result = await service.create_from_sequence(small_sequence)
-        
-        mock_repo.upsert_subsequence.assert_called()
-        mock_repo.insert_subsequences_bulk.assert_not_called()
-        assert result["total_subsequences"] == 63
+        assert result["total_subsequences"] == 63  # 2^6 - 1
+        (subsequences,) = received
+        assert not isinstance(subsequences, list)
+        assert sum(1 for _ in subsequences) == 63
 
 
 class TestBulkWriteIntegration:
@@ -180,7 +290,19 @@ class TestBulkWriteIntegration:
             assert "items_hash" in doc
             assert "sequence_id" in doc
             assert "created_at" in doc
-            assert doc["sequence_id"] == seq_id
+            assert doc["sequence_id"] == ObjectId(seq_id)
+    
+    @pytest.mark.asyncio
+    async def test_bulk_write_reinsert_is_noop(self, mock_mongodb):
+        """Test que reinsertar las mismas subsecuencias no duplica documentos"""
+        repo = SubsequenceRepository(mock_mongodb)
+        seq_id = await repo.insert_sequence([1, 2])
+        subsequences = [[1], [2], [1, 2]]
+
+        assert await repo.insert_subsequences_bulk(seq_id, subsequences) == 3
+        assert await repo.insert_subsequences_bulk(seq_id, subsequences) == 0
+        assert len(mock_mongodb["subsequences"]) == 3
+        assert len(mock_mongodb["subsequences"].by_hash) == 3
     
     @pytest.mark.asyncio
     async def test_service_integration_with_bulk(self, mock_mongodb):
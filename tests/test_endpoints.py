@@ -1,3 +1,4 @@
+import asyncio
 from datetime import datetime, timedelta, timezone
 
 import jwt
@@ -98,6 +99,8 @@ class TestSubsequencesEndpoint:
     @pytest.mark.asyncio
     async def test_list_subsequences_success(self, client, auth_headers):
         """Test listar subsecuencias con éxito"""
+        await client.post("/sequences", json={"items": [1, 2, 3]}, headers=auth_headers)
+
         # GET /subsequences
         response = await client.get("/subsequences", headers=auth_headers)
         assert response.status_code == status.HTTP_200_OK
@@ -127,26 +130,25 @@ class TestSubsequencesEndpoint:
     @pytest.mark.asyncio
     async def test_list_subsequences_invalid_limit(self, client, auth_headers):
         """Test listar subsecuencias con límite inválido"""
-        # Límite menor al mínimo (0)
-        response = await client.get("/subsequences?limit=0", headers=auth_headers)
-        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
-        
-        # Límite mayor al máximo (51)
-        response = await client.get("/subsequences?limit=51", headers=auth_headers)
-        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
-        
-        # Límite no numérico
-        response = await client.get("/subsequences?limit=abc", headers=auth_headers)
-        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+        # Menor al mínimo (0), mayor al máximo (51) y no numérico, en paralelo
+        responses = await asyncio.gather(*(
+            client.get(f"/subsequences?limit={limit}", headers=auth_headers)
+            for limit in ("0", "51", "abc")
+        ))
+        for response in responses:
+            assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
     
     @pytest.mark.asyncio
     async def test_subsequences_ordering(self, client, auth_headers):
         """Verificar que las subsecuencias están ordenadas correctamente"""
+        await client.post("/sequences", json={"items": [4, 1, 3, 2]}, headers=auth_headers)
+
         # GET /subsequences
         response = await client.get("/subsequences", headers=auth_headers)
         data = response.json()
         
         # Verificar orden de subsecuencias en el primer item
+        assert len(data) > 0
         if len(data) > 0:
             subsequences = data[0]["sub_sequences"]
             
@@ -163,6 +165,33 @@ class TestSubsequencesEndpoint:
                     assert len(prev) < len(curr), f"Longitudes desordenadas: {prev} y {curr}"
 
 
+class TestResponseSchemas:
+    """Las rutas responden sin re-validar, pero el esquema sigue documentado"""
+
+    @pytest.mark.asyncio
+    async def test_openapi_keeps_response_models(self, client):
+        response = await client.get("/openapi.json")
+        assert response.status_code == status.HTTP_200_OK
+
+        paths = response.json()["paths"]
+        seq_schema = paths["/sequences"]["post"]["responses"]["200"]["content"]
+        sub_schema = paths["/subsequences"]["get"]["responses"]["200"]["content"]
+        assert seq_schema["application/json"]["schema"]["$ref"].endswith("/SequenceOut")
+        items_ref = sub_schema["application/json"]["schema"]["items"]["$ref"]
+        assert items_ref.endswith("/SubsequenceListItem")
+
+    @pytest.mark.asyncio
+    async def test_create_response_matches_sequence_out(self, client, auth_headers):
+        from app.models.schemas import SequenceOut
+
+        response = await client.post(
+            "/sequences", json={"items": [3, 1, 2]}, headers=auth_headers
+        )
+        assert response.status_code == status.HTTP_200_OK
+        data = response.json()
+        assert SequenceOut.model_validate(data).model_dump() == data
+
+
 class TestEndToEndFlow:
     """Tests de flujo completo de la aplicación"""
     
@@ -191,8 +220,23 @@ class TestEndToEndFlow:
         assert isinstance(data, list)
         
         # Verificar que se devuelven en orden (más recientes primero)
-        # Nota: Este test depende de la implementación del mock
+        assert [item["sequence"] for item in data] == [[4, 5, 6], [1, 2, 3]]
     
+    @pytest.mark.asyncio
+    async def test_service_shared_between_requests(self, client, auth_headers, mock_mongodb):
+        """El servicio se construye en el startup y escribe en la DB compartida"""
+        from app.main import app
+        from app.services.subsequence_service import SubsequenceService
+
+        service = app.state.service
+        assert isinstance(service, SubsequenceService)
+        assert service.repo.db is mock_mongodb
+
+        response = await client.post("/sequences", json={"items": [7, 8]}, headers=auth_headers)
+        assert response.status_code == status.HTTP_200_OK
+        assert app.state.service is service
+        assert len(mock_mongodb["sequences"]) == 1
+
     @pytest.mark.asyncio
     async def test_large_sequence_rejection(self, client, auth_headers):
         """Test que secuencias muy grandes (n>18) son rechazadas"""
@@ -253,6 +297,17 @@ class TestHealthCheck:
         assert data["status"] == "healthy"
         assert data["database"] == "connected"
         assert data["service"] == "sequence-api"
+
+    @pytest.mark.asyncio
+    async def test_health_check_uses_this_tests_db(self, client, mock_mongodb, monkeypatch):
+        """Con el cliente de sesión, /health consulta la base fake de este test"""
+        async def failing_command(command):
+            raise RuntimeError("ping failed")
+
+        monkeypatch.setattr(mock_mongodb, "command", failing_command)
+        response = await client.get("/health")
+        assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+        assert response.json()["detail"]["error"] == "ping failed"
     
     @pytest.mark.asyncio
     async def test_health_check_database_ping(self, client):
@@ -262,4 +317,29 @@ class TestHealthCheck:
         
         data = response.json()
         # El mock de MongoDB simula un ping exitoso
-        assert data["database"] == "connected"
\ No newline at end of file
+        assert data["database"] == "connected"
+
+    @pytest.mark.asyncio
+    async def test_health_check_access_log(self, client, caplog):
+        """Test que el middleware de timing registra el access log"""
+        with caplog.at_level("INFO", logger="app"):
+            response = await client.get("/health", headers={"User-Agent": "pytest-ua"})
+        assert response.status_code == status.HTTP_200_OK
+
+        access = [r.getMessage() for r in caplog.records if r.name == "app"]
+        assert any(
+            "method=GET path=/health status=200" in msg and 'ua="pytest-ua"' in msg
+            for msg in access
+        )
+
+    @pytest.mark.asyncio
+    async def test_warmup_pool_pings_database(self, mock_mongodb):
+        """Test que el warmup abre el pool con pings concurrentes"""
+        from unittest.mock import AsyncMock
+
+        from app.db.mongo import warmup_pool
+
+        mock_mongodb.command = AsyncMock(return_value={"ok": 1.0})
+        await warmup_pool(mock_mongodb, connections=3)
+        assert mock_mongodb.command.await_count == 3
+        mock_mongodb.command.assert_awaited_with("ping")
@@ -1,4 +1,6 @@
+from collections import defaultdict
 from datetime import datetime
+from types import SimpleNamespace
 from unittest.mock import AsyncMock, MagicMock
 
 import pytest
@@ -8,6 +10,7 @@ from app.repositories.subsequence_repo import SubsequenceRepository, _hash_items
 from app.services.subsequence_service import (
     SubsequenceService,
     canonical_sequence,
+    generate_subsequence_keys,
     generate_subsequences,
 )
 
@@ -29,8 +32,20 @@ class TestCanonicalSequence:
     
     def test_empty_and_single(self):
         """Test con lista vacía y elemento único"""
-        assert canonical_sequence([]) == []
+        with pytest.raises(ValueError, match="al menos un elemento"):
+            canonical_sequence([])
         assert canonical_sequence([42]) == [42]
+
+    def test_size_limits(self):
+        """Los mismos límites que aplica el servicio: únicos y entrada cruda"""
+        from app.services.subsequence_service import MAX_INPUT_ITEMS, MAX_UNIQUE_ITEMS
+
+        at_limit = list(range(1, MAX_UNIQUE_ITEMS + 1))
+        assert canonical_sequence(at_limit * 2) == at_limit
+        with pytest.raises(ValueError, match="demasiado grande"):
+            canonical_sequence(at_limit + [MAX_UNIQUE_ITEMS + 1])
+        with pytest.raises(ValueError, match="incluyendo repetidos"):
+            canonical_sequence([1] * (MAX_INPUT_ITEMS + 1))
     
     def test_large_numbers(self):
         """Test con números grandes"""
@@ -76,14 +91,33 @@ class TestGenerateSubsequences:
             same_length = [s for s in subs if len(s) == length]
             assert same_length == sorted(same_length)
     
-    def test_subsequence_count_formula(self):
+    @pytest.mark.parametrize("n,expected_count", [(n, 2**n - 1) for n in range(1, 10)])
+    def test_subsequence_count_formula(self, n, expected_count):
         """Verifica que genera 2^n - 1 subsecuencias"""
-        for n in range(1, 10):
-            items = list(range(1, n + 1))
-            subs = list(generate_subsequences(items))
-            expected_count = 2**n - 1
-            assert len(subs) == expected_count
+        items = list(range(1, n + 1))
+        subs = list(generate_subsequences(items))
+        assert len(subs) == expected_count
     
+    def test_matches_combinations_order(self):
+        """La enumeración por máscaras coincide con itertools.combinations"""
+        from itertools import combinations
+
+        for n in range(1, 12):
+            items = [x * 3 for x in range(1, n + 1)]
+            expected = [
+                list(combo) for k in range(1, n + 1) for combo in combinations(items, k)
+            ]
+            assert list(generate_subsequences(items)) == expected
+
+    def test_cached_tables_are_not_shared(self):
+        """Las tablas cacheadas no se filtran: mutar una salida no afecta la siguiente"""
+        first = list(generate_subsequences([1, 2, 3, 4]))
+        for sub in first:
+            sub.append(99)
+        second = list(generate_subsequences([1, 2, 3, 4]))
+        assert all(99 not in sub for sub in second)
+        assert len(second) == 15
+
     def test_generator_behavior(self):
         """Verifica que es un generador (lazy evaluation)"""
         gen = generate_subsequences([1, 2, 3])
@@ -112,10 +146,24 @@ class TestHashFunction:
         hash2 = _hash_items(items)
         assert hash1 == hash2
     
+    def test_hash_over_canonical_form(self):
+        """El hash se calcula sobre la forma canónica (ordenada) de los items"""
+        assert _hash_items(canonical_sequence([3, 2, 1])) == _hash_items([1, 2, 3])
+        assert _hash_items(canonical_sequence([5, 1, 3])) == _hash_items([1, 3, 5])
+    
     def test_hash_order_independence(self):
-        """Verifica que el orden no importa para el hash"""
+        """Verifica que el orden no importa para el hash (XOR de claves)"""
         assert _hash_items([1, 2, 3]) == _hash_items([3, 2, 1])
         assert _hash_items([5, 1, 3]) == _hash_items([1, 3, 5])
+
+    def test_incremental_keys_match_hash(self):
+        """Las claves por tablas coinciden con _hash_items para cada subsecuencia"""
+        items = [2, 3, 5, 7, 11, 13, 17]
+        subs = list(generate_subsequences(items))
+        keys = list(generate_subsequence_keys(items))
+        assert keys == [_hash_items(sub) for sub in subs]
+        assert len(set(keys)) == len(subs)
+        assert list(generate_subsequence_keys([])) == []
     
     def test_hash_uniqueness(self):
         """Verifica que diferentes inputs producen diferentes hashes"""
@@ -128,32 +176,76 @@ class TestHashFunction:
         assert hash2 != hash3
     
     def test_hash_format(self):
-        """Verifica el formato del hash (SHA256 hexadecimal)"""
+        """Verifica el formato del hash (128 bits como bytes, BSON binary)"""
         hash_val = _hash_items([1, 2, 3])
-        assert isinstance(hash_val, str)
-        assert len(hash_val) == 64  # SHA256 produce 64 caracteres hex
-        assert all(c in '0123456789abcdef' for c in hash_val)
+        assert isinstance(hash_val, bytes)
+        assert len(hash_val) == 16  # 128 bits
+
+    def test_hash_only_defined_for_sets(self):
+        """XOR cancela repetidos: por eso el repositorio exige la forma canónica"""
+        assert _hash_items([1, 1]) == _hash_items([])
+        assert _hash_items([1, 2, 2]) == _hash_items([1])
+
+    def test_hash_depends_on_secret_key(self):
+        """Las claves por elemento usan ITEMS_HASH_KEY: no se pueden calcular sin el secreto"""
+        from hashlib import blake2b
+
+        from app.repositories import subsequence_repo
+
+        raw = (1).to_bytes(8, "little", signed=True)
+        unkeyed = blake2b(raw, digest_size=16).digest()
+        keyed = blake2b(raw, key=subsequence_repo._items_hash_key, digest_size=16).digest()
+        assert _hash_items([1]) != unkeyed
+        assert _hash_items([1]) == int.from_bytes(keyed, "little").to_bytes(16, "big")
+
+
+class StubRepo:
+    """Repositorio de prueba: registra las llamadas sin la maquinaria de AsyncMock"""
+
+    def __init__(self):
+        self.sequence_id = str(ObjectId())
+        self.latest = []
+        self.inserted_subsequences = []
+        # método -> [SimpleNamespace(args, kwargs)]
+        self.calls = defaultdict(list)
+
+    def _record(self, name, *args, **kwargs):
+        self.calls[name].append(SimpleNamespace(args=args, kwargs=kwargs))
+
+    async def insert_sequence(self, items, now=None):
+        self._record("insert_sequence", items, now=now)
+        return self.sequence_id
+
+    async def insert_subsequences_bulk(self, seq_id, subsequences, items_hashes=None, now=None):
+        self._record("insert_subsequences_bulk", seq_id, subsequences, now=now)
+        # Consumir el generador como lo haría el repositorio real
+        batch = list(subsequences)
+        self.inserted_subsequences.extend(batch)
+        return len(batch)
+
+    async def upsert_subsequence(self, sequence_id, items, now=None, *, rank):
+        self._record("upsert_subsequence", sequence_id, items)
+
+    async def latest_grouped(self, limit=10):
+        self._record("latest_grouped", limit=limit)
+        return self.latest
 
 
 class TestSubsequenceService:
     """Tests para la clase SubsequenceService"""
     
     @pytest.fixture
-    def mock_repo(self):
-        """Fixture para mock del repositorio"""
-        repo = AsyncMock(spec=SubsequenceRepository)
-        repo.insert_sequence.return_value = str(ObjectId())
-        repo.upsert_subsequence.return_value = None
-        repo.latest_grouped.return_value = []
-        return repo
+    def stub_repo(self):
+        """Fixture para el repositorio de prueba"""
+        return StubRepo()
     
     @pytest.fixture
-    def service(self, mock_repo):
-        """Fixture para el servicio con repo mockeado"""
-        return SubsequenceService(mock_repo)
+    def service(self, stub_repo):
+        """Fixture para el servicio con el repositorio de prueba"""
+        return SubsequenceService(stub_repo)
     
     @pytest.mark.asyncio
-    async def test_create_from_sequence_basic(self, service, mock_repo):
+    async def test_create_from_sequence_basic(self, service, stub_repo):
         """Test básico de creación de subsecuencias"""
         items = [1, 2, 3]
         result = await service.create_from_sequence(items)
@@ -164,11 +256,23 @@ class TestSubsequenceService:
         assert result["total_subsequences"] == 7
         
         # Verificar llamadas al repositorio
-        mock_repo.insert_sequence.assert_called_once_with([1, 2, 3])
-        assert mock_repo.upsert_subsequence.call_count == 7
+        (insert_call,) = stub_repo.calls["insert_sequence"]
+        assert insert_call.args == ([1, 2, 3],)
+        assert len(stub_repo.calls["insert_subsequences_bulk"]) == 1
+        assert len(stub_repo.inserted_subsequences) == 7
     
     @pytest.mark.asyncio
-    async def test_create_with_duplicates(self, service, mock_repo):
+    async def test_create_uses_single_timestamp(self, service, stub_repo):
+        """Secuencia y subsecuencias comparten el mismo created_at"""
+        await service.create_from_sequence([1, 2, 3])
+
+        now = stub_repo.calls["insert_sequence"][0].kwargs["now"]
+        assert isinstance(now, datetime)
+        assert now.tzinfo is not None
+        assert stub_repo.calls["insert_subsequences_bulk"][0].kwargs["now"] is now
+
+    @pytest.mark.asyncio
+    async def test_create_with_duplicates(self, service, stub_repo):
         """Test con elementos duplicados"""
         items = [3, 1, 2, 1, 3]
         result = await service.create_from_sequence(items)
@@ -177,19 +281,20 @@ class TestSubsequenceService:
         assert result["items"] == [1, 2, 3]
         assert result["total_subsequences"] == 7
         
-        mock_repo.insert_sequence.assert_called_once_with([1, 2, 3])
+        (insert_call,) = stub_repo.calls["insert_sequence"]
+        assert insert_call.args == ([1, 2, 3],)
     
     @pytest.mark.asyncio
-    async def test_create_empty_sequence_error(self, service, mock_repo):
+    async def test_create_empty_sequence_error(self, service, stub_repo):
         """Test que secuencia vacía lanza error"""
         with pytest.raises(ValueError) as exc_info:
             await service.create_from_sequence([])
         
         assert "al menos un elemento" in str(exc_info.value).lower()
-        mock_repo.insert_sequence.assert_not_called()
+        assert stub_repo.calls["insert_sequence"] == []
     
     @pytest.mark.asyncio
-    async def test_create_all_duplicates_single_unique(self, service, mock_repo):
+    async def test_create_all_duplicates_single_unique(self, service, stub_repo):
         """Test con todos duplicados resultando en un único elemento"""
         items = [5, 5, 5, 5]
         result = await service.create_from_sequence(items)
@@ -197,13 +302,14 @@ class TestSubsequenceService:
         assert result["items"] == [5]
         assert result["total_subsequences"] == 1
         
-        mock_repo.insert_sequence.assert_called_once_with([5])
-        mock_repo.upsert_subsequence.assert_called_once_with(
-            mock_repo.insert_sequence.return_value, [5]
-        )
+        (insert_call,) = stub_repo.calls["insert_sequence"]
+        assert insert_call.args == ([5],)
+        (bulk_call,) = stub_repo.calls["insert_subsequences_bulk"]
+        assert bulk_call.args[0] == stub_repo.sequence_id
+        assert stub_repo.inserted_subsequences == [[5]]
     
     @pytest.mark.asyncio
-    async def test_create_large_sequence_error(self, service, mock_repo):
+    async def test_create_large_sequence_error(self, service, stub_repo):
         """Test que secuencia muy grande (>18 únicos) lanza error"""
         items = list(range(1, 20))  # 19 elementos únicos
         
@@ -215,10 +321,41 @@ class TestSubsequenceService:
         assert "18" in error_msg  # Debe mencionar el límite
         assert "262,143" in error_msg or "262143" in error_msg  # 2^19-1
         
-        mock_repo.insert_sequence.assert_not_called()
+        assert stub_repo.calls["insert_sequence"] == []
     
     @pytest.mark.asyncio
-    async def test_create_exactly_18_elements(self, service, mock_repo):
+    async def test_create_large_sequence_rejected_before_generation(
+        self, service, stub_repo, monkeypatch
+    ):
+        """El límite de 18 se valida antes de ordenar o generar nada"""
+        from app.services import subsequence_service
+
+        def fail(*_args, **_kwargs):
+            raise AssertionError("no debe llamarse")
+
+        monkeypatch.setattr(subsequence_service, "generate_subsequences", fail)
+        monkeypatch.setattr(subsequence_service, "generate_subsequence_keys", fail)
+        monkeypatch.setattr(subsequence_service, "sorted", fail, raising=False)
+
+        with pytest.raises(ValueError, match="límite 18"):
+            await service.create_from_sequence(list(range(1, 5000)))
+        assert stub_repo.calls["insert_sequence"] == []
+
+    @pytest.mark.asyncio
+    async def test_create_oversized_input_rejected_before_dedup(self, service, stub_repo):
+        """Test que un payload crudo enorme se rechaza aunque tenga pocos únicos"""
+        from app.services.subsequence_service import MAX_INPUT_ITEMS
+
+        items = [1, 2] * (MAX_INPUT_ITEMS // 2 + 1)
+
+        with pytest.raises(ValueError) as exc_info:
+            await service.create_from_sequence(items)
+
+        assert "demasiado grande" in str(exc_info.value)
+        assert stub_repo.calls["insert_sequence"] == []
+
+    @pytest.mark.asyncio
+    async def test_create_exactly_18_elements(self, service, stub_repo):
         """Test con exactamente 18 elementos (límite máximo)"""
         items = list(range(1, 19))  # 18 elementos
         result = await service.create_from_sequence(items)
@@ -226,31 +363,33 @@ class TestSubsequenceService:
         assert result["items"] == list(range(1, 19))
         assert result["total_subsequences"] == 2**18 - 1  # 262,143
         
-        mock_repo.insert_sequence.assert_called_once()
-        # Con bulk_write habilitado para >=100, no se llamará upsert_subsequence
-        # Verificamos que el repositorio fue instruido a usar bulk
-        assert mock_repo.insert_subsequences_bulk.called
+        assert len(stub_repo.calls["insert_sequence"]) == 1
+        # Todas las subsecuencias pasan por bulk_write, nunca por upsert_subsequence
+        assert stub_repo.calls["insert_subsequences_bulk"]
+        assert stub_repo.calls["upsert_subsequence"] == []
+        assert len(stub_repo.inserted_subsequences) == 2**18 - 1
     
     @pytest.mark.asyncio
-    async def test_list_latest_basic(self, service, mock_repo):
+    async def test_list_latest_basic(self, service, stub_repo):
         """Test básico de listar últimas subsecuencias"""
         mock_data = [
             {
                 "sequence": [1, 2],
-                "subsequences": [[2], [1], [1, 2]]  # Desordenadas a propósito
+                "subsequences": [[1], [2], [1, 2]]  # El repositorio ya las ordena (rank)
             },
             {
                 "sequence": [3, 4, 5],
-                "subsequences": [[3], [5], [4], [3, 4], [4, 5], [3, 5], [3, 4, 5]]
+                "subsequences": [[3], [4], [5], [3, 4], [3, 5], [4, 5], [3, 4, 5]]
             }
         ]
-        mock_repo.latest_grouped.return_value = mock_data
+        stub_repo.latest = mock_data
         
         result = await service.list_latest(limit=10)
         
-        # Verificar que ordena las subsecuencias
+        # Verificar que respeta el orden del repositorio y renombra los campos
         assert result[0]["sequence"] == [1, 2]
-        assert result[0]["sub_sequences"] == [[1], [2], [1, 2]]  # Ordenadas
+        assert result[0]["sub_sequences"] == [[1], [2], [1, 2]]
+        assert "subsequences" not in result[0]
         
         assert result[1]["sequence"] == [3, 4, 5]
         assert result[1]["sub_sequences"] == [
@@ -259,52 +398,48 @@ class TestSubsequenceService:
             [3, 4, 5]  # Longitud 3
         ]
         
-        mock_repo.latest_grouped.assert_called_once_with(limit=10)
+        assert [c.kwargs for c in stub_repo.calls["latest_grouped"]] == [{"limit": 10}]
     
     @pytest.mark.asyncio
-    async def test_list_latest_custom_limit(self, service, mock_repo):
+    async def test_list_latest_custom_limit(self, service, stub_repo):
         """Test listar con límite personalizado"""
-        mock_repo.latest_grouped.return_value = []
-        
         await service.list_latest(limit=5)
-        mock_repo.latest_grouped.assert_called_once_with(limit=5)
-        
         await service.list_latest(limit=50)
-        mock_repo.latest_grouped.assert_called_with(limit=50)
+        assert [c.kwargs for c in stub_repo.calls["latest_grouped"]] == [
+            {"limit": 5},
+            {"limit": 50},
+        ]
     
     @pytest.mark.asyncio
-    async def test_list_latest_empty_result(self, service, mock_repo):
+    async def test_list_latest_empty_result(self, service, stub_repo):
         """Test cuando no hay subsecuencias"""
-        mock_repo.latest_grouped.return_value = []
-        
         result = await service.list_latest()
         assert result == []
-        mock_repo.latest_grouped.assert_called_once_with(limit=10)
+        assert [c.kwargs for c in stub_repo.calls["latest_grouped"]] == [{"limit": 10}]
     
     @pytest.mark.asyncio
-    async def test_subsequence_generation_correctness(self, service, mock_repo):
-        """Test que verifica la correctitud de las subsecuencias generadas"""
-        test_cases = [
+    @pytest.mark.parametrize(
+        "items,expected_count",
+        [
             ([1], 1),
             ([1, 2], 3),
             ([1, 2, 3], 7),
             ([1, 2, 3, 4], 15),
             ([1, 2, 3, 4, 5], 31),
-        ]
+        ],
+    )
+    async def test_subsequence_generation_correctness(
+        self, service, stub_repo, items, expected_count
+    ):
+        """Test que verifica la correctitud de las subsecuencias generadas"""
+        result = await service.create_from_sequence(items)
         
-        for items, expected_count in test_cases:
-            mock_repo.upsert_subsequence.reset_mock()
-            result = await service.create_from_sequence(items)
-            
-            assert result["total_subsequences"] == expected_count
-            assert mock_repo.upsert_subsequence.call_count == expected_count
-            
-            # Verificar que todas las subsecuencias son únicas
-            called_subsequences = [
-                call.args[1] 
-                for call in mock_repo.upsert_subsequence.call_args_list
-            ]
-            assert len(called_subsequences) == len(set(map(tuple, called_subsequences)))
+        assert result["total_subsequences"] == expected_count
+        called_subsequences = stub_repo.inserted_subsequences
+        assert len(called_subsequences) == expected_count
+        
+        # Verificar que todas las subsecuencias son únicas
+        assert len(called_subsequences) == len(set(map(tuple, called_subsequences)))
 
 
 class TestSubsequenceRepository:
@@ -363,31 +498,142 @@ class TestSubsequenceRepository:
         sequence_id = str(ObjectId())
         items = [1, 2]
         
-        await repo.upsert_subsequence(sequence_id, items)
+        await repo.upsert_subsequence(sequence_id, items, rank=2)
         
-        sub_col.insert_one.assert_called_once()
+        sub_col.update_one.assert_called_once()
+        sub_col.insert_one.assert_not_called()
         
-        # Verificar documento
-        call_args = sub_col.insert_one.call_args[0][0]
-        assert call_args["items"] == [1, 2]  # Ordenados
+        # Verificar filtro, upsert y documento
+        filt, update = sub_col.update_one.call_args[0]
+        assert filt == {"items_hash": _hash_items(items)}
+        assert sub_col.update_one.call_args[1] == {"upsert": True}
+        call_args = update["$setOnInsert"]
+        assert call_args["items"] == [1, 2]  # Tal cual: el llamador ya pasa el orden canónico
+        assert call_args["rank"] == 2
         assert call_args["items_hash"] == _hash_items(items)
         assert ObjectId(sequence_id) == call_args["sequence_id"]
         assert isinstance(call_args["created_at"], datetime)
     
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("items", [[1, 1], [1, 2, 2], [2, 1]])
+    async def test_upsert_subsequence_rejects_non_canonical(self, repo, mock_db, items):
+        """Repetidos o desordenados se rechazan antes de escribir nada"""
+        _, _, sub_col = mock_db
+
+        with pytest.raises(ValueError):
+            await repo.upsert_subsequence(str(ObjectId()), items, rank=0)
+        sub_col.update_one.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_upsert_subsequence_requires_rank(self, repo, mock_db):
+        """Sin rank no se escribe nada: un valor por defecto rompería el orden del listado"""
+        _, _, sub_col = mock_db
+
+        with pytest.raises(TypeError):
+            await repo.upsert_subsequence(str(ObjectId()), [1, 2])
+        sub_col.update_one.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_upsert_subsequence_stores_rank(self, mock_mongodb):
+        """El rank guardado es el que define el orden de latest_grouped"""
+        repo = SubsequenceRepository(mock_mongodb)
+        seq_id = await repo.insert_sequence([1, 2])
+        # Insertadas al revés: el listado sigue el rank, no el orden de escritura
+        for rank, items in reversed(list(enumerate([[1], [2], [1, 2]]))):
+            await repo.upsert_subsequence(seq_id, items, rank=rank)
+
+        stored = {tuple(d["items"]): d["rank"] for d in mock_mongodb["subsequences"]}
+        assert stored == {(1,): 0, (2,): 1, (1, 2): 2}
+        result = await repo.latest_grouped(limit=1)
+        assert result == [{"sequence": [1, 2], "subsequences": [[1], [2], [1, 2]]}]
+
     @pytest.mark.asyncio
     async def test_upsert_subsequence_duplicate_ignored(self, repo, mock_db):
         """Test que duplicados son ignorados silenciosamente"""
         db, _, sub_col = mock_db
         
-        # Simular error de duplicado de manera explícita con DuplicateKeyError
+        # Carrera entre dos upserts del mismo hash: MongoDB puede devolver E11000
         from pymongo.errors import DuplicateKeyError
-        sub_col.insert_one.side_effect = DuplicateKeyError("E11000 duplicate key error")
+        sub_col.update_one.side_effect = DuplicateKeyError("E11000 duplicate key error")
         
         # No debe propagar la excepción
         try:
-            await repo.upsert_subsequence("123", [1, 2])
+            await repo.upsert_subsequence("123", [1, 2], rank=2)
             exception_raised = False
         except Exception:
             exception_raised = True
         
-        assert not exception_raised
\ No newline at end of file
+        assert not exception_raised
+
+    @pytest.mark.asyncio
+    async def test_latest_grouped_cached_until_write(self, mock_mongodb, monkeypatch):
+        """latest_grouped reutiliza el resultado hasta el TTL o la próxima escritura"""
+        from app.repositories import subsequence_repo
+
+        repo = SubsequenceRepository(mock_mongodb)
+        seq_id = await repo.insert_sequence([1])
+        await repo.insert_subsequences_bulk(seq_id, [[1]])
+        first = await repo.latest_grouped(limit=10)
+
+        find_calls = []
+        original_find = mock_mongodb["sequences"].find
+
+        def spy(*args, **kwargs):
+            find_calls.append(args)
+            return original_find(*args, **kwargs)
+
+        mock_mongodb["sequences"].find = spy
+        assert await repo.latest_grouped(limit=10) is first
+        assert find_calls == []
+
+        # Una escritura invalida el cache
+        await repo.insert_sequence([2])
+        assert len(await repo.latest_grouped(limit=10)) == 2
+        assert len(find_calls) == 1
+
+        # Vencido el TTL se vuelve a leer
+        monkeypatch.setattr(subsequence_repo, "LATEST_CACHE_TTL", 0.0)
+        await repo.latest_grouped(limit=10)
+        assert len(find_calls) == 2
+
+    @pytest.mark.asyncio
+    async def test_latest_grouped_uses_indexed_reads(self, mock_mongodb):
+        """latest_grouped agrupa por secuencia con dos lecturas (sin aggregate)"""
+        from datetime import timedelta, timezone
+
+        repo = SubsequenceRepository(mock_mongodb)
+        t0 = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+        first = await repo.insert_sequence([1, 2], now=t0)
+        await repo.insert_subsequences_bulk(first, [[1], [2], [1, 2]], now=t0)
+        second = await repo.insert_sequence([3], now=t0 + timedelta(seconds=1))
+        await repo.upsert_subsequence(second, [3], rank=0)
+        # Inserción fuera de orden: el listado respeta rank, no el orden físico
+        mock_mongodb["subsequences"].reverse()
+
+        result = await repo.latest_grouped(limit=10)
+
+        assert result == [
+            {"sequence": [3], "subsequences": [[3]]},
+            {"sequence": [1, 2], "subsequences": [[1], [2], [1, 2]]},
+        ]
+        assert await repo.latest_grouped(limit=1) == result[:1]
+
+        # Solo se piden los campos necesarios
+        find_calls = []
+        for name in ("sequences", "subsequences"):
+            collection = mock_mongodb[name]
+            original_find = collection.find
+
+            def spy(filter_dict=None, projection=None, _name=name, _find=original_find):
+                find_calls.append((_name, projection))
+                return _find(filter_dict, projection)
+
+            collection.find = spy
+        # Repositorio nuevo: sin el cache de latest_grouped del anterior
+        await SubsequenceRepository(mock_mongodb).latest_grouped(limit=10)
+        assert find_calls == [
+            ("sequences", {"items": 1}),
+            ("subsequences", {"items": 1, "sequence_id": 1, "_id": 0}),
+        ]
+        assert await SubsequenceRepository(type(mock_mongodb)()).latest_grouped() == []
@@ -1,3 +1,5 @@
+import asyncio
+
 import pytest
 from fastapi import status
 
@@ -15,19 +17,15 @@ async def test_token_and_flow(client, auth_headers):
 @pytest.mark.asyncio
 async def test_negative_ids_validation(client, auth_headers):
     """Test que valida que los IDs deben ser positivos"""
-    # Test con ID negativo
-    r = await client.post("/sequences", json={"items": [1, -2, 3]}, headers=auth_headers)
-    assert r.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
-    error = r.json()
-    assert "debe ser positivo" in error["detail"][0]["msg"]
-    
-    # Test con cero
-    r = await client.post("/sequences", json={"items": [0, 1, 2]}, headers=auth_headers)
-    assert r.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
-    
-    # Test con todos negativos
-    r = await client.post("/sequences", json={"items": [-1, -2, -3]}, headers=auth_headers)
-    assert r.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+    # ID negativo, cero y todos negativos: validaciones independientes, en paralelo
+    bodies = [[1, -2, 3], [0, 1, 2], [-1, -2, -3]]
+    responses = await asyncio.gather(*(
+        client.post("/sequences", json={"items": items}, headers=auth_headers)
+        for items in bodies
+    ))
+    for r in responses:
+        assert r.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+    assert "debe ser positivo" in responses[0].json()["detail"][0]["msg"]
 
 
 @pytest.mark.asyncio